@@ -0,0 +1,54 @@
+import os
+
+class LogTail:
+    """
+    Keeps the last lines of a file which other processes append to.
+
+    Each call only reads what was appended since the last one, or, if more
+    than block_size bytes were, reads backward from the end of the file in
+    blocks until it has enough lines. Either way the work per call is bounded
+    however large the file grows. At most max_bytes are kept, so a very long
+    line is cut to its end.
+    """
+
+    def __init__(self, path, num_lines=10, block_size=64 * 1024, max_bytes=256 * 1024):
+        self.path = path
+        self.num_lines = num_lines
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self._offset = 0  # Bytes of the file read so far
+        self._tail = b""  # The last num_lines lines up to _offset
+
+    def lines(self):
+        """Return the last lines of the file, with their line endings, as readlines() would"""
+        try:
+            with open(self.path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < self._offset:
+                    # Truncated or replaced, start again
+                    self._offset, self._tail = 0, b""
+                if size - self._offset <= self.block_size:
+                    f.seek(self._offset)
+                    data = self._tail + f.read(size - self._offset)
+                else:
+                    data = self._read_backward(f, size)
+        except FileNotFoundError:
+            return []
+        self._offset = size
+        lines = data.splitlines(keepends=True)[-self.num_lines:]
+        self._tail = b"".join(lines)[-self.max_bytes:]
+        return [line.decode("utf-8", errors="replace") for line in lines]
+
+    def read(self):
+        return "".join(self.lines())
+
+    def _read_backward(self, f, size):
+        data = b""
+        position = size
+        # One more line ending than lines wanted, as the file can end with one
+        while position > 0 and data.count(b"\n") <= self.num_lines and len(data) < self.max_bytes:
+            read_size = min(self.block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+        return data[-self.max_bytes:]
@@ -0,0 +1,142 @@
+import os
+import signal
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# /proc/<pid>/stat state codes
+STATES = {
+    "R": "running",
+    "S": "sleeping",
+    "D": "disk sleep",
+    "Z": "zombie",
+    "T": "stopped",
+    "t": "tracing stop",
+    "X": "dead",
+    "I": "idle",
+}
+
+@dataclass
+class ProcessInfo:
+    pid: int
+    ppid: int
+    state: str
+    cpu_seconds: float
+    rss_bytes: int
+    start_ticks: int  # Start time, used to tell a process from a later one reusing its pid
+
+def read_process_table(proc_path="/proc"):
+    """Return {pid: ProcessInfo} for every visible process, from a single scan of /proc"""
+    table = {}
+    for entry in os.listdir(proc_path):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"{proc_path}/{entry}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            # Exited during the scan
+            continue
+        # The command name is in parentheses and can contain spaces, the fields after it start with the state
+        fields = stat[stat.rindex(b")") + 2:].split()
+        state = fields[0].decode()
+        table[int(entry)] = ProcessInfo(
+            pid=int(entry),
+            ppid=int(fields[1]),
+            state=STATES.get(state, state),
+            cpu_seconds=(int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+            start_ticks=int(fields[19]),
+            rss_bytes=int(fields[21]) * PAGE_SIZE,
+        )
+    return table
+
+def exit_status(returncode):
+    if returncode is None:
+        return "exited with unknown code"
+    if returncode < 0:
+        try:
+            return f"killed by {signal.Signals(-returncode).name}"
+        except ValueError:
+            return f"killed by signal {-returncode}"
+    return f"exited with code {returncode}"
+
+class ChildStatusTable:
+    """
+    Builds the agent's child process status from one process table snapshot
+    per turn.
+
+    Running children are listed with their state, CPU and memory use and
+    descendants. Finished children are listed once, with their exit status,
+    runtime, CPU time and peak memory, in the turn they are first seen
+    finished, and after that only counted in a one line summary, so the table
+    only grows with the number of running children.
+    """
+
+    def __init__(self):
+        self.finished = Counter()  # Exit status -> number of children
+        self._cpu_seconds = {}  # (pid, start ticks) -> CPU seconds at the last snapshot
+        self._snapshot_time = None
+
+    def update(self, children):
+        """
+        Return (status text, children still running, children which finished
+        since the last update). Children are ChildProcesses, whose exit is
+        recorded by the ChildSupervisor.
+        """
+        table = read_process_table()
+        now = time.monotonic()
+        interval = now - self._snapshot_time if self._snapshot_time is not None else None
+        descendants = defaultdict(list)
+        for info in table.values():
+            descendants[info.ppid].append(info.pid)
+
+        cpu_seconds = {}
+        running, finished, rows = [], [], []
+        for child in children:
+            info = table.get(child.pid)
+            if child.exited:
+                status = exit_status(child.returncode)
+                self.finished[status] += 1
+                finished.append(child)
+                cpu = f"{child.cpu_seconds:.1f}s" if child.cpu_seconds is not None else ""
+                peak_rss = f"{child.peak_rss_bytes / 2**20:.1f} MB peak" if child.peak_rss_bytes is not None else ""
+                rows.append(f"{child.filename} | {child.pid} | {status.upper()} after {child.runtime_seconds:.1f}s | {cpu} | {peak_rss} |")
+                continue
+            running.append(child)
+            if info is None:
+                rows.append(f"{child.filename} | {child.pid} | UNKNOWN | | | |")
+                continue
+            key = (info.pid, info.start_ticks)
+            cpu_seconds[key] = info.cpu_seconds
+            cpu_percent = ""
+            if interval and key in self._cpu_seconds:
+                cpu_percent = f"{100 * (info.cpu_seconds - self._cpu_seconds[key]) / interval:.0f}%"
+            rows.append(f"{child.filename} | {child.pid} | {info.state.upper()} | {info.cpu_seconds:.1f}s {cpu_percent}".rstrip()
+                        + f" | {info.rss_bytes / 2**20:.1f} MB | {self._describe_descendants(child.pid, table, descendants)}")
+        self._cpu_seconds = cpu_seconds
+        self._snapshot_time = now
+
+        lines = []
+        if rows:
+            lines.append("Script | PID | Status | CPU | RSS | Descendants")
+            lines.extend(rows)
+        else:
+            lines.append("No active child processes")
+        earlier = self.finished - Counter(exit_status(child.returncode) for child in finished)
+        if +earlier:
+            lines.append(f"Finished earlier: {', '.join(f'{count} {status}' for status, count in sorted(earlier.items()))}")
+        return "\n".join(lines), running, finished
+
+    def _describe_descendants(self, pid, table, descendants):
+        states = Counter()
+        pending = list(descendants[pid])
+        while pending:
+            descendant = pending.pop()
+            states[table[descendant].state] += 1
+            pending.extend(descendants[descendant])
+        if not states:
+            return "none"
+        return ", ".join(f"{count} {state}" for state, count in sorted(states.items()))
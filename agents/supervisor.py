@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+
+from warm_launcher import WarmLauncher
+
+logger = logging.getLogger(__name__)
+
+# How often children are checked when pidfds aren't available
+POLL_INTERVAL_SECONDS = 0.2
+
+@dataclass
+class ChildProcess:
+    filename: str
+    pid: int
+    stdout_filepath: str
+    stderr_filepath: str
+    process: subprocess.Popen  # None for children forked by the warm launcher
+    started_at: float = field(default_factory=time.monotonic)
+    # Filled in by the supervisor once the child exits
+    exited: bool = False
+    returncode: int = None  # Stays None if the child's exit code can't be known
+    runtime_seconds: float = None
+    cpu_seconds: float = None
+    peak_rss_bytes: int = None
+
+def process_alive(pid):
+    """Whether pid is running, as opposed to gone or a zombie"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return False
+    return stat[stat.rindex(b")") + 2:].split()[0] != b"Z"
+
+class ChildSupervisor:
+    """
+    Starts the agent's child processes and reaps them as soon as they exit.
+
+    A background thread waits on a pidfd for each child (or, on kernels
+    without pidfds, checks them every POLL_INTERVAL_SECONDS) and reaps it
+    with wait4, recording its exit code, runtime, CPU time and peak memory.
+    Children never linger as zombies, and the agent's copies of their log
+    files are closed as soon as they are started.
+
+    With warm set, children are forked from a WarmLauncher which has the
+    interpreter and common modules already loaded, instead of starting a new
+    interpreter each time. The launcher is their parent and reports their
+    exits. If it dies children are started directly again, and those it
+    left running are watched until they exit, with an unknown exit code.
+    """
+
+    def __init__(self, warm=False):
+        self.spawned = 0
+        self.reaped = 0
+        self._running = {}  # pid -> ChildProcess
+        self._pidfds = {}  # pidfd -> pid
+        self._lock = threading.Lock()
+        self._use_pidfds = hasattr(os, "pidfd_open")
+        self._poller = select.poll()
+        # Written to when a child is added, to wake the thread to register its pidfd
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._poller.register(self._wakeup_read, select.POLLIN)
+        self._pending_pidfds = []  # (pidfd, pid) to register
+        self.launcher = None
+        self._launcher_buffer = b""
+        self._next_request_id = 0
+        self._warm_requests = {}  # request id -> (ChildProcess without a pid, forked event)
+        if warm:
+            try:
+                self.launcher = WarmLauncher()
+                self._poller.register(self.launcher.fileno(), select.POLLIN)
+            except OSError as e:
+                logger.warning(f"Failed to start the warm launcher, starting children directly: {e}")
+                self.launcher = None
+        threading.Thread(target=self._run, name="child-supervisor", daemon=True).start()
+
+    def spawn(self, filename, stdout_filepath, stderr_filepath):
+        """Start a python script with its output going to the log files, returning its ChildProcess"""
+        if self.launcher is not None:
+            child = self._spawn_warm(filename, stdout_filepath, stderr_filepath)
+            if child is not None:
+                return child
+        with open(stdout_filepath, 'w') as stdout_file, open(stderr_filepath, 'w') as stderr_file:
+            # The child has its own copies of the log file descriptors, the agent's are closed on leaving the block
+            process = subprocess.Popen(["/usr/bin/python3", filename], stdout=stdout_file, stderr=stderr_file)
+        child = ChildProcess(filename=filename, pid=process.pid, stdout_filepath=stdout_filepath,
+                             stderr_filepath=stderr_filepath, process=process)
+        with self._lock:
+            self.spawned += 1
+            self._running[child.pid] = child
+            if self._use_pidfds:
+                try:
+                    self._pending_pidfds.append((os.pidfd_open(child.pid), child.pid))
+                except OSError as e:
+                    # Unsupported by the kernel, fall back to checking every child periodically
+                    logger.warning(f"pidfd_open failed, polling children instead: {e}")
+                    self._use_pidfds = False
+        os.write(self._wakeup_write, b"\0")
+        return child
+
+    def _spawn_warm(self, filename, stdout_filepath, stderr_filepath):
+        child = ChildProcess(filename=filename, pid=None, stdout_filepath=stdout_filepath,
+                             stderr_filepath=stderr_filepath, process=None)
+        forked = threading.Event()
+        with self._lock:
+            launcher = self.launcher
+            if launcher is None:
+                return None
+            request_id = self._next_request_id
+            self._next_request_id += 1
+            # The supervisor thread fills in the pid, and registers the child before reading its exit
+            self._warm_requests[request_id] = (child, forked)
+        try:
+            launcher.request(request_id, filename, stdout_filepath, stderr_filepath)
+        except OSError as e:
+            logger.warning(f"Warm launcher request failed: {e}")
+        # No timeout: once the request is written the launcher may still fork the child however slow it is,
+        # so the child is only started directly if the launcher exited, which also sets forked
+        forked.wait()
+        with self._lock:
+            del self._warm_requests[request_id]
+        if child.pid is None:
+            return None
+        return child
+
+    def stats(self):
+        with self._lock:
+            running = len(self._running)
+        return {"spawned": self.spawned, "running": running, "reaped": self.reaped, "open_fds": len(os.listdir("/proc/self/fd"))}
+
+    def _run(self):
+        while True:
+            timeout_ms = None if self._use_pidfds else POLL_INTERVAL_SECONDS * 1000
+            events = self._poller.poll(timeout_ms)
+            with self._lock:
+                for fd, _ in events:
+                    if fd == self._wakeup_read:
+                        os.read(self._wakeup_read, 4096)
+                    elif self.launcher is not None and fd == self.launcher.fileno():
+                        self._read_launcher()
+                    elif fd in self._pidfds:
+                        self._poller.unregister(fd)
+                        os.close(fd)
+                        self._reap(self._pidfds.pop(fd))
+                for pidfd, pid in self._pending_pidfds:
+                    self._pidfds[pidfd] = pid
+                    self._poller.register(pidfd, select.POLLIN)
+                self._pending_pidfds.clear()
+                if not self._use_pidfds:
+                    for pid in list(self._running):
+                        self._reap(pid)
+
+    def _read_launcher(self):
+        # Must be called with self._lock held
+        data = os.read(self.launcher.fileno(), 65536)
+        if not data:
+            logger.warning(f"Warm launcher exited with {self.launcher.process.wait()}, starting children directly")
+            self._poller.unregister(self.launcher.fileno())
+            try:
+                self.launcher.close()
+            except OSError:
+                # Flushing the request pipe to a dead launcher
+                pass
+            self.launcher = None
+            for _, forked in self._warm_requests.values():
+                forked.set()
+            for child in list(self._running.values()):
+                if child.process is None:
+                    self._watch_orphan(child.pid)
+            return
+        self._launcher_buffer += data
+        while b"\n" in self._launcher_buffer:
+            line, self._launcher_buffer = self._launcher_buffer.split(b"\n", 1)
+            message = json.loads(line)
+            if "id" in message:
+                child, forked = self._warm_requests[message["id"]]
+                child.pid = message["pid"]
+                self.spawned += 1
+                self._running[child.pid] = child
+                forked.set()
+            else:
+                child = self._running.get(message["pid"])
+                if child is not None:
+                    self._record_exit(child, message["returncode"], message["cpu_seconds"], message["peak_rss_bytes"])
+
+    def _watch_orphan(self, pid):
+        # Must be called with self._lock held. The child of a launcher which died now belongs to init, which reaps it
+        if self._use_pidfds:
+            try:
+                pidfd = os.pidfd_open(pid)
+            except OSError:
+                # Already gone
+                self._reap(pid)
+                return
+            self._pidfds[pidfd] = pid
+            self._poller.register(pidfd, select.POLLIN)
+        else:
+            self._reap(pid)
+
+    def _reap(self, pid):
+        # Must be called with self._lock held
+        child = self._running.get(pid)
+        if child is None:
+            return
+        if child.process is None:
+            # Children forked by the warm launcher are reaped by it, and only need checking once it's gone
+            if self.launcher is None and not process_alive(pid):
+                self._record_exit(child, None, None, None)
+            return
+        try:
+            reaped_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+        except ChildProcessError:
+            # Reaped elsewhere, e.g. by Popen.wait
+            reaped_pid, status, rusage = pid, None, None
+        if reaped_pid == 0:
+            return
+        if status is None:
+            self._record_exit(child, child.process.returncode, None, None)
+            return
+        returncode = os.waitstatus_to_exitcode(status)
+        # Popen would otherwise report 0 for a child it can no longer wait for
+        child.process.returncode = returncode
+        # ru_maxrss is in kilobytes on Linux
+        self._record_exit(child, returncode, rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss * 1024)
+
+    def _record_exit(self, child, returncode, cpu_seconds, peak_rss_bytes):
+        # Must be called with self._lock held
+        del self._running[child.pid]
+        self.reaped += 1
+        child.runtime_seconds = time.monotonic() - child.started_at
+        child.exited = True
+        child.returncode = returncode
+        child.cpu_seconds = cpu_seconds
+        child.peak_rss_bytes = peak_rss_bytes
+        logger.info(f"Child {child.filename} ({child.pid}) exited with {child.returncode} after {child.runtime_seconds:.1f}s")
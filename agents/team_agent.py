@@ -1,12 +1,13 @@
 import logging
 import os
-import psutil
-import subprocess
+import time
 import uuid
-from dataclasses import dataclass
 from dotenv import load_dotenv
 
 from llm_client import LLMClient
+from log_tail import LogTail
+from proc_table import ChildStatusTable
+from supervisor import ChildSupervisor
 
 load_dotenv()
 
@@ -62,21 +63,21 @@ communication file last 10 lines:
 Generate a new Python program to run in a separate process, or not if you don't think a new process is needed.
 """
 
-@dataclass
-class ChildProcess:
-    filename: str
-    pid: int
-    stdout_filepath: str
-    stderr_filepath: str
-
 class Agent:
 
     def __init__(self, team_name: str, other_team_name: str, communication_file: str):
         self.messages = self._generate_initial_messages(team_name, other_team_name, communication_file)
         self.communication_file = communication_file
         self.last_response_status = None
+        self.out_of_budget = False
         self.llm_client = LLMClient()
         self.child_processes = []
+        # Children which finished since the last observation, their logs are shown one last time
+        self.finished_child_processes = []
+        self.child_status_table = ChildStatusTable()
+        self.supervisor = ChildSupervisor(warm=os.environ.get("AGENT_WARM_SPAWN") == "1")
+        # Log file path -> LogTail, so each turn only reads what the children logged since the last
+        self.log_tails = {}
 
     def _generate_initial_messages(self, team_name: str, other_team_name: str, communication_file: str):
         current_script_path = os.path.abspath(__file__)
@@ -104,45 +105,39 @@ class Agent:
         return [user_message, assistant_message]
     
     def _check_child_processes(self):
-        process_table = []
-        for child in self.child_processes:
-            try:
-                process = psutil.Process(child.pid)
-                status = "RUNNING" if process.is_running() else "STOPPED"
-            except psutil.NoSuchProcess:
-                status = "TERMINATED"
-            process_table.append(f"{child.filename} | {child.pid} | {status}")
-
-        if not process_table:
-            return "No active child processes"
+        status, self.child_processes, self.finished_child_processes = self.child_status_table.update(self.child_processes)
+        stats = self.supervisor.stats()
+        return (f"{status}\nSupervisor: {stats['spawned']} spawned, {stats['running']} running, {stats['reaped']} reaped, "
+                f"{stats['open_fds']} open file descriptors in this process")
 
-        return "Script | PID | Status\n" + "\n".join(process_table)
+    def _tail_log(self, filepath):
+        if filepath not in self.log_tails:
+            self.log_tails[filepath] = LogTail(filepath)
+        return self.log_tails[filepath]
 
     def _get_child_process_logs(self):
         logs = []
-        for child in self.child_processes:
+        for child in self.child_processes + self.finished_child_processes:
             logs.append(f"child process id {child.pid}")
 
             logs.append(f"stdout log filename {child.stdout_filepath} last 10 lines:")
-            with open(child.stdout_filepath, "r") as f:
-                lines = f.readlines()
-                last_10 = lines[-10:] if len(lines) >= 10 else lines
-                logs.append("".join(last_10))
+            logs.append(self._tail_log(child.stdout_filepath).read())
 
             logs.append(f"stderr log filename {child.stderr_filepath} last 10 lines:")
-            with open(child.stderr_filepath, "r") as f:
-                lines = f.readlines()
-                last_10 = lines[-10:] if len(lines) >= 10 else lines
-                logs.append("".join(last_10))
+            logs.append(self._tail_log(child.stderr_filepath).read())
 
             logs.append("")
 
+        for child in self.finished_child_processes:
+            self.log_tails.pop(child.stdout_filepath, None)
+            self.log_tails.pop(child.stderr_filepath, None)
+
         return "\n".join(logs)
 
     def _get_env_update_message(self):
         child_process_status = self._check_child_processes()
         child_process_logs = self._get_child_process_logs()
-        communication_file_last_10_lines = open(self.communication_file, "r").readlines()[-10:]
+        communication_file_last_10_lines = self._tail_log(self.communication_file).lines()
         return NEXT_MOVE_PROMPT.format(
             last_response_status=self.last_response_status if self.last_response_status else "N/A",
             child_process_status=child_process_status,
@@ -156,8 +151,23 @@ class Agent:
             "role": "user",
             "content": env_update_message
         })
-        
-        response = self.llm_client.generate(self.messages)
+
+        # Stream the response so the program can be written as soon as its code block is complete,
+        # it is started once the server commits the turn
+        response = None
+        new_process_file = None
+        for event in self.llm_client.generate_stream(self.messages):
+            if event["type"] == "code":
+                new_process_file = self._write_process_file(event["code"])
+            elif event["type"] == "commit" and new_process_file:
+                self._start_process(new_process_file)
+            elif event["type"] == "done":
+                response = event["text"]
+            elif event["type"] == "error":
+                logger.error(f"Error from LLM server: {event['error']}")
+                # The server rejects every further request once the agent's budget is spent
+                self.out_of_budget = event.get("status") == 402
+
         self.messages.append({
             "role": "assistant",
             "content": response
@@ -165,58 +175,54 @@ class Agent:
 
         if not response:
             logger.error("Failed to generate code")
-            return
-
-        if "```python" in response:
-            code_block = response.split("```python")[1].split("```")[0].strip()
-        else:
+        elif "```python" not in response:
             logger.info(f"No code block found in response: {response}")
-            return
-    
+
+    def _write_process_file(self, code_block):
         if not code_block.strip():
             logger.info("Empty code block found in response")
-            return
-        
+            return None
+
         logger.info(f"Generated code for new process:\n{code_block}")
-        
+
         spawn_id = str(uuid.uuid4())[:8]
         new_process_file = os.path.join(os.environ["AGENT_SPACE"], f"agent_spawn_{spawn_id}.py")
-        stdout_file = open(os.path.join(os.environ["AGENT_LOGS"], f"agent_spawn_{spawn_id}.log"), 'w', buffering=1)
-        stderr_file = open(os.path.join(os.environ["AGENT_LOGS"], f"agent_spawn_{spawn_id}_err.log"), 'w', buffering=1)
-        
         try:
             with open(new_process_file, "w") as f:
                 f.write(code_block)
+        except Exception as e:
+            logger.error(f"Failed to write process file: {str(e)}")
+            self.last_response_status = f"Failed to spawn process: {str(e)}"
+            return None
 
-            logger.info(f"Wrote code to {new_process_file}")
+        logger.info(f"Wrote code to {new_process_file}")
+        return new_process_file
 
-            process = subprocess.Popen(
-                ["/usr/bin/python3", new_process_file],
-                stdout=stdout_file,
-                stderr=stderr_file,
-                universal_newlines=True,
-                bufsize=1
+    def _start_process(self, new_process_file):
+        log_name = os.path.splitext(os.path.basename(new_process_file))[0]
+        try:
+            child = self.supervisor.spawn(
+                new_process_file,
+                os.path.join(os.environ["AGENT_LOGS"], f"{log_name}.log"),
+                os.path.join(os.environ["AGENT_LOGS"], f"{log_name}_err.log")
             )
-            logger.info(f"Spawned new process with PID: {process.pid}")
+            logger.info(f"Spawned new process with PID: {child.pid}")
 
-            self.child_processes.append(ChildProcess(
-                filename=new_process_file,
-                pid=process.pid,
-                stdout_filepath=stdout_file.name,
-                stderr_filepath=stderr_file.name
-            ))
+            self.child_processes.append(child)
 
             logger.info(f"Added new child process to list: {self.child_processes[-1]}")
             self.last_response_status = f"Spawned new process using file {self.child_processes[-1].filename}"
         except Exception as e:
             logger.error(f"Failed to spawn process: {str(e)}")
-            stdout_file.close()
-            stderr_file.close()
             self.last_response_status = f"Failed to spawn process: {str(e)}"
 
     def main_loop(self):
         while True:
             logger.info(f"agent.py is running. Process ID: {os.getpid()}, User ID: {os.getuid()}")
+            if self.out_of_budget:
+                # Keep running so our child processes stay in the game
+                time.sleep(10)
+                continue
             self._spawn_new_process()
 
 def main():
@@ -0,0 +1,134 @@
+"""
+Forkserver-style launcher for generated programs.
+
+Run as a script, the launcher imports the modules generated programs
+commonly use and then waits for requests, one JSON object per line on
+stdin: {"id", "filename", "stdout_filepath", "stderr_filepath"}. For each it
+forks a child, which redirects its output to the log files and runs the
+program as __main__, so the program starts without paying for interpreter
+startup or those imports. The launcher writes {"id", "pid"} to stdout once
+the child is forked, and {"pid", "returncode", "cpu_seconds", "peak_rss_bytes"}
+when it exits.
+
+WarmLauncher starts and talks to the launcher from the agent, see
+ChildSupervisor.
+"""
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+
+# Imported before forking, so programs importing them get them for free
+PRELOAD_MODULES = ["json", "os", "psutil", "re", "signal", "socket", "subprocess", "threading", "time"]
+
+PR_SET_NAME = 15
+
+class WarmLauncher:
+    """The agent's handle on a running launcher process"""
+
+    def __init__(self, python="/usr/bin/python3"):
+        self.process = subprocess.Popen([python, os.path.abspath(__file__)], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def fileno(self):
+        return self.process.stdout.fileno()
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+    def request(self, request_id, filename, stdout_filepath, stderr_filepath):
+        self.process.stdin.write(json.dumps({
+            "id": request_id,
+            "filename": filename,
+            "stdout_filepath": stdout_filepath,
+            "stderr_filepath": stderr_filepath,
+        }).encode() + b"\n")
+        self.process.stdin.flush()
+
+def _write(message):
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+def _report_exits():
+    while True:
+        try:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        _write({
+            "pid": pid,
+            "returncode": os.waitstatus_to_exitcode(status),
+            "cpu_seconds": rusage.ru_utime + rusage.ru_stime,
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_bytes": rusage.ru_maxrss * 1024,
+        })
+
+def serve():
+    """Fork a child for each request, returning the request in the child. Returns None once stdin closes."""
+    for name in PRELOAD_MODULES:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+    # SIGCHLD wakes the select below, so exits are reported straight away
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_write, False)
+    signal.set_wakeup_fd(wakeup_write)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    buffer = b""
+    while True:
+        readable, _, _ = select.select([sys.stdin.fileno(), wakeup_read], [], [])
+        if wakeup_read in readable:
+            os.read(wakeup_read, 4096)
+        _report_exits()
+        if sys.stdin.fileno() not in readable:
+            continue
+        data = os.read(sys.stdin.fileno(), 65536)
+        if not data:
+            # The agent exited
+            return None
+        buffer += data
+        while b"\n" in buffer:
+            line, buffer = buffer.split(b"\n", 1)
+            request = json.loads(line)
+            pid = os.fork()
+            if pid == 0:
+                signal.set_wakeup_fd(-1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                return request
+            _write({"id": request["id"], "pid": pid})
+
+def run_child(request):
+    """Set up the forked child as if it had been started with python3 <filename>, then run the program"""
+    stdin = os.open(os.devnull, os.O_RDONLY)
+    stdout = os.open(request["stdout_filepath"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    stderr = os.open(request["stderr_filepath"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    for fd, target in ((stdin, 0), (stdout, 1), (stderr, 2)):
+        os.dup2(fd, target)
+        os.close(fd)
+    # Drops the launcher's pipes, as Popen's close_fds would
+    os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+
+    filename = request["filename"]
+    try:
+        import ctypes
+        # Shown by ps and top in place of the launcher's name
+        ctypes.CDLL(None).prctl(PR_SET_NAME, os.path.basename(filename).encode()[:15], 0, 0, 0)
+    except (OSError, AttributeError):
+        pass
+    sys.argv = [filename]
+    sys.path[0] = os.path.dirname(os.path.abspath(filename))
+
+    import runpy
+    runpy.run_path(filename, run_name="__main__")
+
+if __name__ == "__main__":
+    child_request = serve()
+    if child_request is not None:
+        run_child(child_request)
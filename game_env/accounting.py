@@ -0,0 +1,109 @@
+import json
+from dataclasses import asdict, dataclass
+
+from completion import estimate_tokens
+
+# USD per million tokens. Agent configs can set "prices" to override these or price other models.
+MODEL_PRICES = {
+    "claude-3-5-sonnet-20241022": {"input": 3.00, "cached_input": 0.30, "cache_write": 3.75, "output": 15.00},
+    "o1": {"input": 15.00, "cached_input": 7.50, "output": 60.00},
+    "o3-mini": {"input": 1.10, "cached_input": 0.55, "output": 4.40},
+    "accounts/fireworks/models/deepseek-r1": {"input": 3.00, "output": 8.00},
+    # Experimental models are free of charge
+    "gemini-2.0-flash-thinking-exp": {"input": 0.0, "output": 0.0},
+    "mock-fast": {"input": 0.0, "output": 0.0},
+    "mock-chat": {"input": 0.0, "output": 0.0},
+    "mock-reasoning": {"input": 0.0, "output": 0.0},
+}
+
+# Limits agent configs can set under "budget"
+BUDGET_LIMITS = ["max_input_tokens", "max_output_tokens", "max_total_tokens", "max_cost_usd"]
+
+def model_prices(agent_config):
+    """Return the agent's model prices, or None if unknown"""
+    return agent_config.get("prices") or MODEL_PRICES.get(agent_config["model"])
+
+def usage_cost(usage, prices):
+    """Return the cost of the usage in USD, or None if the model's prices are unknown"""
+    if prices is None:
+        return None
+    input_price = prices["input"]
+    # Providers without a separate cached or cache write price charge the input price
+    return (
+        usage.uncached_input_tokens * input_price
+        + usage.cached_input_tokens * prices.get("cached_input", input_price)
+        + usage.cache_write_tokens * prices.get("cache_write", input_price)
+        + usage.output_tokens * prices["output"]
+    ) / 1_000_000
+
+@dataclass
+class UsageTotals:
+    calls: int = 0
+    input_tokens: int = 0
+    cached_input_tokens: int = 0
+    cache_write_tokens: int = 0
+    output_tokens: int = 0
+    cost_usd: float = 0.0
+    # True if any call's token counts were estimated or its cost unknown
+    estimated: bool = False
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+
+    def add(self, usage, cost):
+        self.calls += 1
+        self.input_tokens += usage.input_tokens
+        self.cached_input_tokens += usage.cached_input_tokens
+        self.cache_write_tokens += usage.cache_write_tokens
+        self.output_tokens += usage.output_tokens
+        self.cost_usd += cost or 0.0
+        self.estimated = self.estimated or usage.estimated or cost is None
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.input_tokens += other.input_tokens
+        self.cached_input_tokens += other.cached_input_tokens
+        self.cache_write_tokens += other.cache_write_tokens
+        self.output_tokens += other.output_tokens
+        self.cost_usd += other.cost_usd
+        self.estimated = self.estimated or other.estimated
+
+    def to_dict(self):
+        return {**asdict(self), "total_tokens": self.total_tokens}
+
+class BudgetExceededError(Exception):
+    def __init__(self, limit, allowed, used):
+        super().__init__(f"Budget exceeded: {limit} is {allowed}, used {used}")
+        self.limit = limit
+        self.allowed = allowed
+        self.used = used
+
+    def to_dict(self):
+        return {"limit": self.limit, "allowed": self.allowed, "used": self.used}
+
+def check_budget(agent_config, totals, messages):
+    """
+    Raise BudgetExceededError if the request would exceed the agent's budget.
+
+    The request's input tokens are estimated and counted against the budget up
+    front. Its output isn't known yet, so the last call can overshoot the
+    output and cost limits by up to one response.
+    """
+    budget = agent_config.get("budget")
+    if not budget:
+        return
+    request_input_tokens = estimate_tokens(json.dumps(messages))
+    prices = model_prices(agent_config)
+    projected = {
+        "max_input_tokens": totals.input_tokens + request_input_tokens,
+        "max_output_tokens": totals.output_tokens,
+        "max_total_tokens": totals.total_tokens + request_input_tokens,
+        "max_cost_usd": totals.cost_usd + (request_input_tokens * prices["input"] / 1_000_000 if prices else 0.0),
+    }
+    for limit in BUDGET_LIMITS:
+        if limit in budget and projected[limit] > budget[limit]:
+            raise BudgetExceededError(limit, budget[limit], projected[limit])
+    # The output limit only includes output already spent, so stop once it is reached
+    if "max_output_tokens" in budget and totals.output_tokens >= budget["max_output_tokens"]:
+        raise BudgetExceededError("max_output_tokens", budget["max_output_tokens"], totals.output_tokens)
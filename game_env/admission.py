@@ -0,0 +1,88 @@
+import time
+
+class AdmissionRejected(Exception):
+    """A request refused before it is handled, see AdmissionControl"""
+
+    def __init__(self, reason, message, status, retry_after=None):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        result = {"error": str(self), "reason": self.reason}
+        if self.retry_after is not None:
+            result["retry_after"] = round(self.retry_after, 3)
+        return result
+
+class KeyRateLimit:
+    """Token bucket which rejects requests instead of queueing them"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def try_acquire(self):
+        """Take a token, returning None, or the seconds until one is available"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return None
+        return (1 - self._tokens) / self.rate
+
+class AdmissionControl:
+    """
+    Per api key limits, so one agent (or a process it spawned with its key)
+    can't flood the server and slow every other agent's turns.
+
+    Requests are rejected straight away rather than queued, so a flood costs
+    the server almost nothing and never delays other agents' requests. Each
+    key may have at most one generation in flight, a request rate and burst,
+    and bodies and session histories up to a size.
+    """
+
+    def __init__(self, max_body_bytes=4 * 1024 * 1024, max_session_bytes=16 * 1024 * 1024,
+                 requests_per_second=2.0, burst=10):
+        self.max_body_bytes = max_body_bytes
+        self.max_session_bytes = max_session_bytes
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._rate_limits = {}  # api_key -> KeyRateLimit
+        self._generating = set()
+
+    def check_request(self, api_key, content_length):
+        """Raise AdmissionRejected if the key is over its rate limit or the body is too large"""
+        if content_length is not None and content_length > self.max_body_bytes:
+            raise AdmissionRejected("body_too_large", f"Request body is over {self.max_body_bytes} bytes", 413)
+        if self.requests_per_second:
+            rate_limit = self._rate_limits.get(api_key)
+            if rate_limit is None:
+                rate_limit = self._rate_limits[api_key] = KeyRateLimit(self.requests_per_second, self.burst)
+            retry_after = rate_limit.try_acquire()
+            if retry_after is not None:
+                raise AdmissionRejected("rate_limited", "Too many requests", 429, retry_after)
+
+    def check_session_size(self, session_bytes):
+        if session_bytes > self.max_session_bytes:
+            raise AdmissionRejected("session_too_large", f"Session history is over {self.max_session_bytes} bytes", 413)
+
+    def check_generation(self, api_key):
+        """Raise AdmissionRejected if the key already has a generation in flight"""
+        if api_key in self._generating:
+            raise AdmissionRejected("in_flight", "A generation is already in progress for this API key", 429)
+
+    def start_generation(self, api_key):
+        self.check_generation(api_key)
+        self._generating.add(api_key)
+
+    def end_generation(self, api_key):
+        self._generating.discard(api_key)
+
+    def forget(self, api_key):
+        """Drop the key's state once its game has ended"""
+        self._rate_limits.pop(api_key, None)
+        self._generating.discard(api_key)
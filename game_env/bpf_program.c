@@ -10,7 +10,7 @@ struct event_t {
     u32 uid;        // User ID
     u32 kill_pid;   // Target PID for kill events
     char comm[16];  // Process name
-    char type;      // Event type: 'E' exec, 'X' exit, 'K' kill
+    char type;      // Event type: 'E' exec, 'F' fork, 'X' exit, 'K' kill
 };
 
 BPF_PERF_OUTPUT(events);
@@ -31,6 +31,29 @@ int trace_exec(struct pt_regs *ctx) {
     return 0;
 }
 
+// Track new processes, which may never exec, e.g. programs forked by the agents' warm launcher
+int trace_fork(struct bpf_raw_tracepoint_args *ctx) {
+    struct task_struct *child = (struct task_struct *)ctx->args[1];
+    pid_t child_pid = 0, child_tgid = 0;
+    bpf_probe_read_kernel(&child_pid, sizeof(child_pid), &child->pid);
+    bpf_probe_read_kernel(&child_tgid, sizeof(child_tgid), &child->tgid);
+    if (child_pid != child_tgid) {
+        // A new thread, not a new process
+        return 0;
+    }
+
+    struct event_t event = {};
+    event.pid = child_tgid;
+    // Runs in the forking process
+    event.ppid = bpf_get_current_pid_tgid() >> 32;
+    event.uid = bpf_get_current_uid_gid() >> 32;
+    event.type = 'F';
+    bpf_get_current_comm(&event.comm, sizeof(event.comm));
+
+    events.perf_submit(ctx, &event, sizeof(event));
+    return 0;
+}
+
 // We use a map to stash kill args on sys_enter_kill
 BPF_HASH(kill_args, u64, struct event_t);
 
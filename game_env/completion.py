@@ -0,0 +1,45 @@
+import json
+from dataclasses import dataclass, field, asdict
+
+# Rough conversion used when a provider doesn't report token counts
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+@dataclass
+class Usage:
+    """
+    Token usage for a provider call.
+
+    input_tokens counts every input token, including cached_input_tokens (read
+    from the provider's prompt cache) and cache_write_tokens (written to it).
+    """
+    input_tokens: int = None
+    cached_input_tokens: int = 0
+    cache_write_tokens: int = 0
+    output_tokens: int = None
+    estimated: bool = False
+
+    def fill_estimates(self, messages, text):
+        """Estimate any counts the provider didn't report, e.g. when a stream was stopped early"""
+        if self.input_tokens is None:
+            self.input_tokens = estimate_tokens(json.dumps(messages))
+            self.estimated = True
+        if self.output_tokens is None:
+            self.output_tokens = estimate_tokens(text)
+            self.estimated = True
+
+    @property
+    def uncached_input_tokens(self):
+        return self.input_tokens - self.cached_input_tokens - self.cache_write_tokens
+
+    def to_dict(self):
+        return {**asdict(self), "uncached_input_tokens": self.uncached_input_tokens}
+
+@dataclass
+class Completion:
+    """Result of a provider call"""
+    text: str
+    stopped_early: bool = False
+    usage: Usage = field(default_factory=Usage)
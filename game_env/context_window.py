@@ -0,0 +1,213 @@
+import json
+import logging
+from dataclasses import dataclass
+
+from completion import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+# Input tokens available to the prompt, leaving room for the response (and reasoning, for reasoning
+# models). Agent configs can set "context_window": {"max_input_tokens": ...} to override these or
+# for other models, requests for models with no limit are never compacted.
+MAX_INPUT_TOKENS = {
+    "claude-3-5-sonnet-20241022": 190_000,
+    "o1": 100_000,
+    "o3-mini": 100_000,
+    "accounts/fireworks/models/deepseek-r1": 128_000,
+    "gemini-2.0-flash-thinking-exp": 900_000,
+    "mock-fast": 100_000,
+    "mock-chat": 100_000,
+    "mock-reasoning": 100_000,
+}
+
+# Defaults for the agent config's "context_window" settings
+CONTEXT_WINDOW_DEFAULTS = {
+    # Compact once a request is over compact_at of max_input_tokens, down to compact_to of it.
+    # Compacting further than needed means the sent history stays the same for the next few
+    # turns, so the provider's prompt cache still covers it.
+    "compact_at": 0.9,
+    "compact_to": 0.7,
+    # The most recent turns, including the one being requested, are never compacted
+    "keep_recent_turns": 4,
+    # Applied in order until the request fits, see apply_compaction
+    "policies": ["elide_observations", "drop_turns"],
+}
+
+COMPACTION_POLICIES = ("elide_observations", "drop_turns")
+
+# Rough per-message overhead for the role and formatting
+MESSAGE_OVERHEAD_TOKENS = 4
+
+ELIDED_OBSERVATION = "[Observation from turn {turn} omitted to fit the context window]"
+DROPPED_TURNS = "[The first {count} turns were omitted to fit the context window]\n\n"
+
+def turn_starts(messages):
+    """
+    Return the index of each turn's first message. The first user message and
+    the reply to it hold the game prompt and are never compacted, every later
+    user message, an observation of the game, starts a turn.
+    """
+    return [idx for idx in range(2, len(messages)) if messages[idx]["role"] == "user"]
+
+def apply_compaction(messages, compaction):
+    """
+    Return the messages sent to the model for a compaction record:
+
+        elided: the observations of this many of the oldest turns are replaced by a placeholder
+        dropped: this many of the oldest turns are removed, and the next turn notes it
+
+    Compaction records are logged with each interaction, so the messages the
+    model saw can be rebuilt from the logged conversation.
+    """
+    starts = turn_starts(messages)
+    if not starts:
+        return list(messages)
+    bounds = starts + [len(messages)]
+    sent = list(messages[:starts[0]])
+    for turn in range(compaction["dropped"], len(starts)):
+        turn_messages = list(messages[bounds[turn]:bounds[turn + 1]])
+        observation = turn_messages[0]
+        if turn < compaction["elided"]:
+            observation = {**observation, "content": ELIDED_OBSERVATION.format(turn=turn)}
+        if turn == compaction["dropped"] and compaction["dropped"]:
+            observation = {**observation, "content": DROPPED_TURNS.format(count=compaction["dropped"]) + observation["content"]}
+        turn_messages[0] = observation
+        sent.extend(turn_messages)
+    return sent
+
+def _content_text(content):
+    return content if isinstance(content, str) else json.dumps(content)
+
+class TokenCounter:
+    """
+    Counts a request's input tokens before it is sent.
+
+    Uses the provider's local tokenizer where it has one (see
+    Provider.tokenizer). Otherwise tokens are estimated from characters, with
+    the characters per token calibrated from the input token counts the
+    provider reports.
+    """
+
+    def __init__(self, count_text=None):
+        self._count_text = count_text
+        self._cache = {}
+        self.chars_per_token = float(CHARS_PER_TOKEN)
+
+    @property
+    def method(self):
+        return "tokenizer" if self._count_text is not None else "estimate"
+
+    def count_text(self, text):
+        if self._count_text is None:
+            return int(len(text) / self.chars_per_token)
+        # Earlier turns are resent with every request, so cache their counts
+        count = self._cache.get(text)
+        if count is None:
+            if len(self._cache) >= 4096:
+                self._cache.clear()
+            count = self._cache[text] = self._count_text(text)
+        return count
+
+    def count(self, messages):
+        return sum(MESSAGE_OVERHEAD_TOKENS + self.count_text(_content_text(message["content"])) for message in messages)
+
+    def calibrate(self, messages, input_tokens):
+        """Update the characters per token from the provider's input token count for the messages"""
+        if self._count_text is not None or not input_tokens:
+            return
+        chars = sum(len(_content_text(message["content"])) for message in messages)
+        tokens = max(1, input_tokens - MESSAGE_OVERHEAD_TOKENS * len(messages))
+        self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * (chars / tokens)
+
+@dataclass
+class CompactionState:
+    elided: int = 0
+    dropped: int = 0
+
+class ContextCompactor:
+    """
+    Keeps requests within the model's context window.
+
+    Agents resend their whole history each turn, including every observation
+    of their child processes' logs, so long games outgrow the context window.
+    Before each call the request's tokens are counted, and once they pass
+    compact_at of the limit the compaction policies are applied, oldest turns
+    first. Compaction only ever grows for an agent, so the history sent stays
+    stable between compactions.
+    """
+
+    def __init__(self):
+        self._counters = {}  # model -> TokenCounter
+        self._states = {}  # api_key -> CompactionState
+
+    def settings(self, agent_config):
+        """Return the agent's context window settings, or None if its model has no known limit"""
+        settings = {**CONTEXT_WINDOW_DEFAULTS, **agent_config.get("context_window", {})}
+        settings.setdefault("max_input_tokens", MAX_INPUT_TOKENS.get(agent_config["model"]))
+        if settings["max_input_tokens"] is None:
+            return None
+        unknown = [policy for policy in settings["policies"] if policy not in COMPACTION_POLICIES]
+        if unknown:
+            raise ValueError(f"Unknown compaction policies: {', '.join(unknown)}")
+        return settings
+
+    def counter(self, agent_config, provider):
+        model = agent_config['model']
+        if model not in self._counters:
+            self._counters[model] = TokenCounter(provider.tokenizer(model))
+        return self._counters[model]
+
+    def forget(self, api_key):
+        self._states.pop(api_key, None)
+
+    def compact(self, api_key, messages, agent_config, provider):
+        """
+        Return (messages to send, compaction record). The record is None if
+        nothing was compacted, otherwise it holds the elided and dropped counts
+        for apply_compaction, the token counts before and after, and whether
+        the compaction grew with this request.
+        """
+        settings = self.settings(agent_config)
+        if settings is None:
+            return messages, None
+        counter = self.counter(agent_config, provider)
+        state = self._states.setdefault(api_key, CompactionState())
+        # Turns which may be compacted, fewer than before if the agent started a new history
+        compactable = max(0, len(turn_starts(messages)) - settings["keep_recent_turns"])
+        compaction = {"elided": min(state.elided, compactable), "dropped": min(state.dropped, compactable)}
+
+        input_tokens = counter.count(messages)
+        sent = apply_compaction(messages, compaction)
+        sent_tokens = counter.count(sent)
+        grew = False
+        max_input_tokens = settings["max_input_tokens"]
+        if sent_tokens > settings["compact_at"] * max_input_tokens:
+            target = settings["compact_to"] * max_input_tokens
+            for policy in settings["policies"]:
+                count_name = "elided" if policy == "elide_observations" else "dropped"
+                while sent_tokens > target and compaction[count_name] < compactable:
+                    compaction[count_name] += 1
+                    grew = True
+                    sent = apply_compaction(messages, compaction)
+                    sent_tokens = counter.count(sent)
+            if sent_tokens > max_input_tokens:
+                logger.warning(f"Request for {agent_config['name']} is {sent_tokens} tokens after compaction, "
+                               f"over the limit of {max_input_tokens}")
+        state.elided, state.dropped = compaction["elided"], compaction["dropped"]
+
+        if not compaction["elided"] and not compaction["dropped"]:
+            return messages, None
+        return sent, {
+            **compaction,
+            "grew": grew,
+            "input_tokens": input_tokens,
+            "sent_input_tokens": sent_tokens,
+            "max_input_tokens": max_input_tokens,
+            "counted_by": counter.method,
+        }
+
+    def record_usage(self, agent_config, sent_messages, usage):
+        """Calibrate the model's token estimates from the provider's reported usage"""
+        counter = self._counters.get(agent_config['model'])
+        if counter is not None and not usage.estimated:
+            counter.calibrate(sent_messages, usage.input_tokens)
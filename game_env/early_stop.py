@@ -0,0 +1,141 @@
+import os
+import time
+from collections import Counter, defaultdict, deque
+
+from completion import CHARS_PER_TOKEN
+
+# One in this many responses per model isn't stopped early, it runs to completion in the background
+# to measure what stopping early saves. 0 disables sampling.
+SAMPLE_EVERY = int(os.environ.get("LLM_SERVER_EARLY_STOP_SAMPLE_EVERY", "10"))
+
+OPEN_FENCE = "```python"
+FENCE = "```"
+
+class CodeBlockCutoff:
+    """
+    Tracks a streamed response and finds the point where generation can stop.
+
+    Agents only use the first ```python block, so once it is closed the only
+    other useful output is the reasoning summary. If the summary came before
+    the block the cutoff is the closing fence, otherwise it is the end of the
+    first paragraph after the block (or the start of the next fence).
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.cutoff = None
+        self.first_delta_time = None
+        self.cutoff_time = None
+        self._open = None
+        self._close = None
+        self._searched = 0
+
+    @property
+    def code(self):
+        """The first python block, parsed the same way agents parse it, or None until it is closed."""
+        if self._close is None:
+            return None
+        return self.text[self._open + len(OPEN_FENCE):self._close - len(FENCE)].strip()
+
+    def feed(self, delta):
+        """Add a streamed delta, returns True once the cutoff has been reached."""
+        if self.first_delta_time is None:
+            self.first_delta_time = time.monotonic()
+        self.text += delta
+        if self.cutoff is None:
+            self._scan()
+            if self.cutoff is not None:
+                self.cutoff_time = time.monotonic()
+        return self.cutoff is not None
+
+    def _scan(self):
+        text = self.text
+        if self._open is None:
+            idx = text.find(OPEN_FENCE, self._searched)
+            if idx == -1:
+                self._searched = max(0, len(text) - len(OPEN_FENCE))
+                return
+            self._open = idx
+            self._searched = idx + len(OPEN_FENCE)
+
+        if self._close is None:
+            idx = text.find(FENCE, self._searched)
+            if idx == -1:
+                self._searched = max(self._searched, len(text) - len(FENCE))
+                return
+            self._close = idx + len(FENCE)
+            if text[:self._open].strip():
+                # The reasoning summary came before the code block
+                self.cutoff = self._close
+                return
+
+        start = self._close + len(text[self._close:]) - len(text[self._close:].lstrip())
+        if start >= len(text):
+            return
+        ends = [idx for idx in (text.find("\n\n", start), text.find(FENCE, start)) if idx != -1]
+        if ends:
+            self.cutoff = min(ends)
+
+class EarlyStopStats:
+    """
+    Estimates what stopping early saved, per model.
+
+    The first response for each model, and one in sample_every after it,
+    isn't stopped early. The agent still gets the response at the cutoff, but
+    generation runs to completion in the background, measuring how much the
+    model writes after the cutoff and how long it takes. Responses from agents
+    with early stop disabled are measured the same way. The mean of the recent
+    samples gives the estimated tokens and milliseconds saved by each response
+    stopped early. Until a model has a sample its reports give
+    calibration_samples 0 and no estimate.
+
+    Providers don't report output usage for a stream stopped early, and
+    reasoning tokens aren't in the text, so finished responses also give the
+    mean output tokens the model spends beyond its text.
+    """
+
+    def __init__(self, max_samples=50, sample_every=SAMPLE_EVERY):
+        self.sample_every = sample_every
+        self._responses = Counter()  # model -> responses early stop applied to
+        self._tails = defaultdict(lambda: deque(maxlen=max_samples))  # model -> (chars, seconds) after the cutoff
+        self._hidden_tokens = defaultdict(lambda: deque(maxlen=max_samples))  # model -> output tokens not in the text
+
+    def should_sample(self, model):
+        """Whether to run the next response early stop applies to to completion"""
+        sample = self.sample_every > 0 and self._responses[model] % self.sample_every == 0
+        self._responses[model] += 1
+        return sample
+
+    def record_sample(self, model, cutoff, end_time):
+        """Record a response which ran to completion, returning what was generated after its cutoff"""
+        if cutoff.cutoff is None:
+            return None
+        tail_chars = len(cutoff.text) - cutoff.cutoff
+        tail_seconds = max(0.0, end_time - cutoff.cutoff_time)
+        self._tails[model].append((tail_chars, tail_seconds))
+        return {"tail_tokens": round(tail_chars / CHARS_PER_TOKEN), "tail_ms": round(tail_seconds * 1000)}
+
+    def record_output_tokens(self, model, output_tokens, text_tokens):
+        """Record a finished response's reported output tokens, learning how many weren't in its text, e.g. reasoning tokens"""
+        self._hidden_tokens[model].append(max(0, output_tokens - text_tokens))
+
+    def hidden_tokens(self, model):
+        """Mean output tokens per response which aren't in its text, 0 until a response for the model has finished"""
+        samples = self._hidden_tokens[model]
+        return round(sum(samples) / len(samples)) if samples else 0
+
+    def record(self, model, cutoff, stopped_early):
+        """Return the early stop report for a response returned to the agent"""
+        report = {"stopped_early": stopped_early}
+        if cutoff.cutoff is None or not stopped_early:
+            return report
+
+        tails = self._tails[model]
+        report["calibration_samples"] = len(tails)
+        if not tails:
+            report["estimated_tokens_saved"] = None
+            report["estimated_ms_saved"] = None
+            return report
+        report["estimated_tokens_saved"] = round(sum(chars for chars, _ in tails) / len(tails) / CHARS_PER_TOKEN)
+        report["estimated_ms_saved"] = round(sum(seconds for _, seconds in tails) / len(tails) * 1000)
+        return report
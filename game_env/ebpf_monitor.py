@@ -83,6 +83,11 @@ class EbpfMonitor:
         if not attached:
             raise Exception("Could not attach to any execve probe points. Is BPF supported and enabled?")
 
+        try:
+            self.bpf.attach_raw_tracepoint(tp="sched_process_fork", fn_name="trace_fork")
+        except Exception as e:
+            self.logger.error(f"Failed to attach fork tracepoint: {str(e)}")
+
         try:
             self.bpf.attach_kprobe(event="do_exit", fn_name="trace_exit")
         except Exception as e:
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class EventFeed:
+    """
+    Publishes a game's events to any number of subscribers.
+
+    Events are dicts with an increasing "id", a "type" and a "time". Recent
+    events are kept so a subscriber which reconnects can resume after the last
+    id it saw. Subscribers which fall more than max_queue events behind are
+    disconnected rather than buffering without bound.
+    """
+
+    def __init__(self, history=1000, max_queue=1000):
+        self.closed = False
+        self.max_queue = max_queue
+        self._next_id = 1
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+
+    def publish(self, type, **fields):
+        event = {"id": self._next_id, "type": type, "time": time.time(), **fields}
+        self._next_id += 1
+        self._history.append(event)
+        for queue in list(self._subscribers):
+            if queue.qsize() >= self.max_queue:
+                logger.warning(f"Disconnecting event subscriber which is {queue.qsize()} events behind")
+                self._disconnect(queue)
+            else:
+                queue.put_nowait(event)
+
+    def close(self):
+        """Close every subscription once it has received the events already published"""
+        self.closed = True
+        for queue in list(self._subscribers):
+            self._subscribers.discard(queue)
+            queue.put_nowait(None)
+
+    def _disconnect(self, queue):
+        # Drop the events the subscriber hasn't read, it can resume from its last id after reconnecting
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def subscribe(self, last_id=0, keepalive_seconds=15):
+        """
+        Yield events after last_id as they are published, until the feed is
+        closed. Yields None after keepalive_seconds without an event, so
+        callers can check their connection is still open.
+        """
+        queue = asyncio.Queue()
+        for event in self._history:
+            if event["id"] > last_id:
+                queue.put_nowait(event)
+        if self.closed:
+            queue.put_nowait(None)
+        else:
+            self._subscribers.add(queue)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            self._subscribers.discard(queue)
@@ -0,0 +1,82 @@
+import json
+from datetime import datetime
+
+from context_window import apply_compaction
+
+class InteractionLog:
+    """
+    Conversation-aware writer for llm_interactions.jsonl.
+
+    Each entry only holds the messages that were not already logged for the api
+    key, along with the offset they start at in the full conversation. The
+    assistant response is counted as logged, so when an agent appends it to its
+    history it isn't written again on the next turn. If the conversation no
+    longer extends what was logged, the entry falls back to offset 0 and holds
+    the full message list.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # api_key -> (number of messages in the last request, its last message, the logged response message)
+        self._logged = {}
+
+    def offset(self, api_key, messages):
+        """Return the offset of the first message not yet logged for the api key."""
+        if api_key not in self._logged:
+            return 0
+        count, last_message, response_message = self._logged[api_key]
+        if len(messages) > count and messages[count] == response_message and messages[count - 1] == last_message:
+            return count + 1
+        if len(messages) >= count and messages[count - 1] == last_message:
+            return count
+        return 0
+
+    def append(self, api_key, agent_name, messages, response, **fields):
+        offset = self.offset(api_key, messages)
+        log_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "agent_name": agent_name,
+            "api_key": api_key,
+            "offset": offset,
+            "messages": messages[offset:],
+            "response": response,
+            **fields
+        }
+
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(log_entry) + '\n')
+
+        self._logged[api_key] = (len(messages), messages[-1], {"role": "assistant", "content": response})
+
+def read_interactions(path):
+    """
+    Yield the entries of an llm_interactions.jsonl file with the full conversation rebuilt.
+
+    Each yielded entry has "messages" set to the agent's complete message list
+    for that turn and "turn" set to the entry's index for its api key. Entries
+    whose request was compacted to fit the context window also have
+    "sent_messages", the messages the model was actually sent. Files written
+    before delta logging, where every entry holds the full message list, are
+    read as-is.
+    """
+    conversations = {}  # api_key -> full conversation including the last response
+    turns = {}
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            api_key = entry.get('api_key', 'No API key')
+            offset = entry.get('offset', 0)
+            entry['messages'] = conversations.get(api_key, [])[:offset] + entry['messages']
+            entry['turn'] = turns.get(api_key, 0)
+            turns[api_key] = entry['turn'] + 1
+            conversations[api_key] = entry['messages'] + [{"role": "assistant", "content": entry['response']}]
+            if entry.get('compaction'):
+                entry['sent_messages'] = apply_compaction(entry['messages'], entry['compaction'])
+            yield entry
+
+def conversation_at_turn(path, api_key, turn):
+    """Return the log entry, with the full conversation, for the api key's given turn (0-indexed)."""
+    for entry in read_interactions(path):
+        if entry.get('api_key', 'No API key') == api_key and entry['turn'] == turn:
+            return entry
+    raise ValueError(f"No turn {turn} found for api key {api_key} in {path}")
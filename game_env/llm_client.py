@@ -1,34 +1,366 @@
+import asyncio
+import json
 import logging
 import os
+import socket
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
-class LLMClient:
-    def __init__(self, server_url="http://127.0.0.1:5000", api_key=None):
-        self.server_url = server_url
+# Seconds to wait to connect to the server, and between reads. The stream can be quiet for minutes
+# while a reasoning model thinks, or while the turn barrier waits for the other agents.
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("LLM_CLIENT_CONNECT_TIMEOUT_SECONDS", "5"))
+READ_TIMEOUT_SECONDS = float(os.environ.get("LLM_CLIENT_READ_TIMEOUT_SECONDS", "600"))
+
+# Only failures to connect are retried. Generating isn't idempotent, so a request the
+# server may have received is never sent again.
+CONNECT_RETRIES = 3
+
+# Requests the server's admission control turned away before handling them are sent again after the
+# server's Retry-After, or IN_FLIGHT_RETRY_SECONDS if it gave none, for up to RATE_LIMIT_WAIT_SECONDS
+RETRIED_REJECTIONS = ("rate_limited", "in_flight")
+IN_FLIGHT_RETRY_SECONDS = 1.0
+RATE_LIMIT_WAIT_SECONDS = float(os.environ.get("LLM_CLIENT_RATE_LIMIT_WAIT_SECONDS", "120"))
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, *args, socket_path=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout if isinstance(self.timeout, (int, float)) else None)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise NewConnectionError(self, f"Failed to connect to {self.socket_path}: {e}") from e
+        return sock
+
+class UnixHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = UnixHTTPConnection
+
+class UnixSocketAdapter(HTTPAdapter):
+    """Sends every request to the server over a unix domain socket, whatever the URL's host"""
+
+    def __init__(self, socket_path, pool_maxsize=10, max_retries=0):
+        super().__init__(max_retries=max_retries)
+        self._pool = UnixHTTPConnectionPool("localhost", maxsize=pool_maxsize, socket_path=socket_path)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool
+
+    def get_connection(self, url, proxies=None):
+        return self._pool
+
+    def close(self):
+        super().close()
+        self._pool.close()
+
+class BaseLLMClient:
+    """
+    Request building and session bookkeeping shared by LLMClient and AsyncLLMClient.
+
+    With sessions the server keeps the conversation history and each request
+    only carries new messages. Requests go over TCP to server_url, or over the
+    unix domain socket at socket_path (LLM_SERVER_SOCKET) if one is given.
+    """
+
+    def __init__(self, server_url=None, api_key=None, use_sessions=True, socket_path=None):
+        self.server_url = server_url or os.environ.get("LLM_SERVER_URL", "http://127.0.0.1:5000")
+        self.socket_path = socket_path or os.environ.get("LLM_SERVER_SOCKET") or None
         self.api_key = api_key or os.environ.get("AGENT_API_KEY")
         assert self.api_key is not None, "API key must be provided either directly or through AGENT_API_KEY environment variable"
-        logger.info(f"Initialized LLMClient with server URL: {server_url}")
+        self.headers = {"X-Agent-API-Key": self.api_key}
+        self.use_sessions = use_sessions
+        self._session_id = None
+        self._synced = 0  # Number of messages the server session holds
+        self._last_synced = None  # The last message the server session holds
+        # Seconds of the last request not spent in the server, see _record_overhead
+        self.last_overhead_seconds = None
+        # Seconds the current request waited to be retried after being rate limited
+        self._rate_limit_wait_seconds = 0.0
+        logger.info(f"Initialized {type(self).__name__} with server URL: {self.server_url}"
+                    f"{f', over unix socket {self.socket_path}' if self.socket_path else ''}")
+
+    def _new_messages(self, messages):
+        """Return the messages the server session doesn't hold yet, or None if the history no longer matches it"""
+        if self._session_id is None or len(messages) < self._synced:
+            return None
+        if self._synced and messages[self._synced - 1] != self._last_synced:
+            return None
+        return messages[self._synced:]
+
+    def _mark_synced(self, messages):
+        self._synced = len(messages)
+        self._last_synced = messages[-1] if messages else None
+
+    def _opened_session(self, response_json, messages):
+        self._session_id = response_json["session_id"]
+        self._mark_synced(messages)
+        logger.debug(f"Opened session {self._session_id} with {len(messages)} messages")
+
+    def _session_request(self, route, messages):
+        return f"{self.server_url}/sessions/{self._session_id}/{route}", {"messages": messages, "offset": self._synced}
+
+    def _session_response(self, status_code, messages):
+        if status_code == 200:
+            self._mark_synced(messages)
+        else:
+            # Unknown what the session holds now, reopen it on the next request
+            self._session_id = None
+
+    def _record_response(self, response_text):
+        # The server session appends the response, which the agent is expected to add to its history
+        if self.use_sessions and self._session_id is not None:
+            self._synced += 1
+            self._last_synced = {"role": "assistant", "content": response_text}
+
+    def _rate_limit_delay(self, response, waited):
+        """Return the seconds to wait before resending a request admission control rejected, or None to not resend it"""
+        if response.status_code != 429:
+            return None
+        try:
+            rejection = response.json()
+        except ValueError:
+            return None
+        if rejection.get("reason") not in RETRIED_REJECTIONS:
+            return None
+        delay = rejection.get("retry_after") or float(response.headers.get("Retry-After", IN_FLIGHT_RETRY_SECONDS))
+        if waited + delay > RATE_LIMIT_WAIT_SECONDS:
+            logger.warning(f"LLM server rejected request ({rejection['reason']}) after waiting {waited:.1f}s, giving up")
+            return None
+        logger.info(f"LLM server rejected request ({rejection['reason']}), retrying in {delay:.2f}s")
+        self._rate_limit_wait_seconds += delay
+        return delay
+
+    def _record_overhead(self, route, client_seconds, server_seconds):
+        """Log the time a request took outside the server: connecting, sessions, (de)serialising and transport"""
+        if server_seconds is None:
+            return
+        self.last_overhead_seconds = client_seconds - self._rate_limit_wait_seconds - server_seconds
+        logger.info(f"LLM server {route} took {client_seconds:.3f}s, {server_seconds:.3f}s in the server, "
+                    f"client overhead {self.last_overhead_seconds * 1000:.1f}ms")
+
+class LLMClient(BaseLLMClient):
+    """
+    Client for the LLM server, keeping connections open between turns.
+
+    Calls don't raise: generate returns None and generate_stream yields an
+    error event if the request fails or times out. Requests which were rate
+    limited are retried, see RETRIED_REJECTIONS.
+    """
+
+    def __init__(self, server_url=None, api_key=None, use_sessions=True, socket_path=None):
+        super().__init__(server_url, api_key, use_sessions, socket_path)
+        self.timeout = (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS)
+        retries = Retry(total=CONNECT_RETRIES, connect=CONNECT_RETRIES, read=0, status=0, other=0, redirect=0, backoff_factor=0.2)
+        self._http = requests.Session()
+        if self.socket_path:
+            self._http.mount(self.server_url, UnixSocketAdapter(self.socket_path, max_retries=retries))
+        else:
+            self._http.mount(self.server_url, HTTPAdapter(max_retries=retries))
+
+    def close(self):
+        self._http.close()
+
+    def _request(self, url, body, **kwargs):
+        waited = 0.0
+        while True:
+            response = self._http.post(url, json=body, headers=self.headers, timeout=self.timeout, **kwargs)
+            delay = self._rate_limit_delay(response, waited)
+            if delay is None:
+                return response
+            response.close()
+            time.sleep(delay)
+            waited += delay
+
+    def _open_session(self, messages):
+        response = self._request(f"{self.server_url}/sessions", {"messages": messages})
+        response.raise_for_status()
+        self._opened_session(response.json(), messages)
+
+    def _post_to_session(self, route, messages, **kwargs):
+        """POST the messages the session doesn't hold yet to a session route, reopening the session if needed"""
+        new_messages = self._new_messages(messages)
+        if new_messages is None:
+            self._open_session(messages)
+            new_messages = []
+
+        response = self._request(*self._session_request(route, new_messages), **kwargs)
+        if response.status_code in (404, 409):
+            # The server lost or disagrees with our session, send the full history again
+            logger.debug(f"Session {self._session_id} rejected with status {response.status_code}, reopening")
+            response.close()
+            self._open_session(messages)
+            response = self._request(*self._session_request(route, []), **kwargs)
+
+        self._session_response(response.status_code, messages)
+        return response
+
+    def _post(self, route, messages, **kwargs):
+        if self.use_sessions:
+            return self._post_to_session(route, messages, **kwargs)
+        return self._request(f"{self.server_url}/{route}", {"messages": messages}, **kwargs)
 
     def generate(self, messages):
         """
         Generate a response from the LLM server
-        
+
         Args:
             messages: List of message dictionaries, each containing 'role' and 'content'
                      Example: [{"role": "user", "content": "Hello"}, {"role": "assistant", "content": "Hi"}]
         """
         try:
             logger.debug(f"Sending request to LLM server with {len(messages)} messages")
-            response = requests.post(
-                f"{self.server_url}/generate",
-                json={"messages": messages},
-                headers={"X-Agent-API-Key": self.api_key}
-            )
+            start_time = time.monotonic()
+            self._rate_limit_wait_seconds = 0.0
+            response = self._post("generate", messages)
             response.raise_for_status()
             logger.debug("Successfully received response from LLM server")
-            return response.json()["text"]
+            data = response.json()
+            self._record_overhead("generate", time.monotonic() - start_time, data.get("server_seconds"))
+            self._record_response(data["text"])
+            return data["text"]
         except Exception as e:
             logger.error(f"Error generating response: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def generate_stream(self, messages):
+        """
+        Stream a response from the LLM server, yielding event dictionaries as they arrive.
+
+        Events have a "type" of:
+            delta: {"text"} the next piece of response text
+            code: {"code"} the first python block, as soon as it is complete
+            commit: the code can be acted on, in simultaneous turn mode this waits for all agents
+            done: {"text", "turn", "barrier_wait_seconds", "usage", "server_seconds"} the full response,
+                  the turn it counted for, its token usage and the time the server took
+            error: {"error", "status"} generation failed, no further events follow
+        """
+        try:
+            logger.debug(f"Sending streaming request to LLM server with {len(messages)} messages")
+            start_time = time.monotonic()
+            self._rate_limit_wait_seconds = 0.0
+            # Time the caller spent handling events isn't client overhead
+            paused_seconds = 0.0
+            with self._post("generate_stream", messages, stream=True) as response:
+                if response.status_code != 200:
+                    yield {"type": "error", "error": response.text, "status": response.status_code}
+                    return
+                for line in response.iter_lines():
+                    if line:
+                        event = json.loads(line)
+                        if event["type"] == "done":
+                            self._record_overhead("generate_stream", time.monotonic() - start_time - paused_seconds, event.get("server_seconds"))
+                            self._record_response(event["text"])
+                        yielded_at = time.monotonic()
+                        yield event
+                        paused_seconds += time.monotonic() - yielded_at
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            yield {"type": "error", "error": str(e), "status": None}
+
+class AsyncLLMClient(BaseLLMClient):
+    """asyncio variant of LLMClient, with the same methods as coroutines"""
+
+    def __init__(self, server_url=None, api_key=None, use_sessions=True, socket_path=None):
+        super().__init__(server_url, api_key, use_sessions, socket_path)
+        import httpx
+        transport = httpx.AsyncHTTPTransport(uds=self.socket_path, retries=CONNECT_RETRIES)
+        self._http = httpx.AsyncClient(
+            transport=transport,
+            headers=self.headers,
+            timeout=httpx.Timeout(READ_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+        )
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def _request(self, url, body, stream):
+        waited = 0.0
+        while True:
+            response = await self._http.send(self._http.build_request("POST", url, json=body), stream=stream)
+            if response.status_code == 429:
+                await response.aread()
+            delay = self._rate_limit_delay(response, waited)
+            if delay is None:
+                return response
+            await response.aclose()
+            await asyncio.sleep(delay)
+            waited += delay
+
+    async def _open_session(self, messages):
+        response = await self._request(f"{self.server_url}/sessions", {"messages": messages}, stream=False)
+        response.raise_for_status()
+        self._opened_session(response.json(), messages)
+
+    async def _send(self, route, messages, stream):
+        """Send a generation request, returning a response whose body hasn't been read"""
+        if not self.use_sessions:
+            return await self._request(f"{self.server_url}/{route}", {"messages": messages}, stream)
+
+        new_messages = self._new_messages(messages)
+        if new_messages is None:
+            await self._open_session(messages)
+            new_messages = []
+
+        response = await self._request(*self._session_request(route, new_messages), stream)
+        if response.status_code in (404, 409):
+            # The server lost or disagrees with our session, send the full history again
+            logger.debug(f"Session {self._session_id} rejected with status {response.status_code}, reopening")
+            await response.aclose()
+            await self._open_session(messages)
+            response = await self._request(*self._session_request(route, []), stream)
+
+        self._session_response(response.status_code, messages)
+        return response
+
+    async def generate(self, messages):
+        """Generate a response from the LLM server, see LLMClient.generate"""
+        try:
+            start_time = time.monotonic()
+            self._rate_limit_wait_seconds = 0.0
+            response = await self._send("generate", messages, stream=False)
+            response.raise_for_status()
+            data = response.json()
+            self._record_overhead("generate", time.monotonic() - start_time, data.get("server_seconds"))
+            self._record_response(data["text"])
+            return data["text"]
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            return None
+
+    async def generate_stream(self, messages):
+        """Stream a response from the LLM server, see LLMClient.generate_stream for the events"""
+        try:
+            start_time = time.monotonic()
+            self._rate_limit_wait_seconds = 0.0
+            paused_seconds = 0.0
+            response = await self._send("generate_stream", messages, stream=True)
+            try:
+                if response.status_code != 200:
+                    await response.aread()
+                    yield {"type": "error", "error": response.text, "status": response.status_code}
+                    return
+                async for line in response.aiter_lines():
+                    if line:
+                        event = json.loads(line)
+                        if event["type"] == "done":
+                            self._record_overhead("generate_stream", time.monotonic() - start_time - paused_seconds, event.get("server_seconds"))
+                            self._record_response(event["text"])
+                        yielded_at = time.monotonic()
+                        yield event
+                        paused_seconds += time.monotonic() - yielded_at
+            finally:
+                await response.aclose()
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            yield {"type": "error", "error": str(e), "status": None}
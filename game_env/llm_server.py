@@ -1,57 +1,122 @@
+import time
+
+# Recorded before the heavier imports so startup time covers them
+SERVER_START_TIME = time.monotonic()
+
 import argparse
 import asyncio
 import json
 import logging
 import os
+import socket
 import sys
-import threading
-import time
-from collections import defaultdict
-from datetime import datetime
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
 
-from anthropic import Anthropic
+import uvicorn
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-from openai import OpenAI
-from google import genai
-from google.genai import types
+from quart import Quart, request, jsonify, make_response
+
+from admission import AdmissionControl, AdmissionRejected
+from accounting import BudgetExceededError, UsageTotals, check_budget, model_prices, usage_cost
+from completion import Usage
+from context_window import ContextCompactor
+from early_stop import CodeBlockCutoff, EarlyStopStats
+from event_feed import EventFeed
+from interaction_log import InteractionLog
+from metrics import MetricsRegistry
+from providers import PROVIDERS, InvalidProviderError, get_provider, initialized_providers, provider_health
+from response_cache import ResponseCache
+from scheduler import ProviderScheduler, load_scheduler_configs
+from turn_barrier import TurnBarrier
 
 load_dotenv()
 
-app = Flask(__name__)
+app = Quart(__name__)
 
-# Setup LLM clients
-claude_client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
-openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-openrouter_client = OpenAI(
-  base_url="https://openrouter.ai/api/v1",
-  api_key=os.environ.get("OPENROUTER_API_KEY"),
-)
-hyperbolic_client = OpenAI(
-  base_url="https://api.hyperbolic.xyz/v1",
-  api_key=os.environ.get("HYPERBOLIC_API_KEY"),
+# Store agent configurations, for the agents of every game
+agent_configs = {}
+
+# Games served by this process, see register_game
+DEFAULT_GAME_ID = "default"
+games = {}
+game_by_key = {}
+
+# Required to register and end games over HTTP, registration is disabled when unset
+ADMIN_TOKEN = os.environ.get("LLM_SERVER_ADMIN_TOKEN")
+
+# Server-side conversation history per api key, see the /sessions routes
+sessions = {}
+
+# Keeps requests within each model's context window, see context_window.py
+context_compactor = ContextCompactor()
+
+# Per api key limits on concurrent generations, request rate and body and session size, see admission.py
+admission = AdmissionControl(
+    max_body_bytes=int(os.environ.get("LLM_SERVER_MAX_BODY_BYTES", str(4 * 1024 * 1024))),
+    max_session_bytes=int(os.environ.get("LLM_SERVER_MAX_SESSION_BYTES", str(16 * 1024 * 1024))),
+    requests_per_second=float(os.environ.get("LLM_SERVER_KEY_REQUESTS_PER_SECOND", "2")),
+    burst=int(os.environ.get("LLM_SERVER_KEY_BURST", "10")),
 )
-fireworks_client = OpenAI(
-  base_url="https://api.fireworks.ai/inference/v1",
-  api_key=os.environ.get("FIREWORKS_API_KEY"),
+# Quart rejects larger bodies while reading them, covering requests without a Content-Length
+app.config["MAX_CONTENT_LENGTH"] = admission.max_body_bytes
+
+# Response cache, see response_cache.py for the record, replay and passthrough modes
+response_cache = ResponseCache(
+    os.environ.get("LLM_SERVER_CACHE_DIR", os.path.join(os.environ.get('ROOT_LOGS', '.'), 'llm_cache')),
+    mode=os.environ.get("LLM_SERVER_CACHE_MODE", "passthrough"),
+    max_entries=int(os.environ.get("LLM_SERVER_CACHE_MAX_ENTRIES", "10000")),
 )
-gemini_client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
 
-# Store agent configurations
-agent_configs = {}
+# Per-provider in-flight limits, rate limits, retries and hedging, see scheduler.py
+scheduler_configs = load_scheduler_configs(os.environ.get("LLM_SERVER_PROVIDER_LIMITS"))
+schedulers = {}
+
+# Running provider warm-ups, kept so they aren't garbage collected, and warm-ups for games
+# registered before the event loop started, which are started once the server is serving
+warm_up_tasks = set()
+pending_warm_ups = []
 
 # Replace @app.before_first_request with a flag and before_request
 _configs_loaded = False
 
-# Add after existing global variables
+# Seconds idle agent connections are kept open, longer than uvicorn's default of 5 seconds so
+# an agent's connection is reused from turn to turn
+KEEP_ALIVE_SECONDS = int(os.environ.get("LLM_SERVER_KEEP_ALIVE_SECONDS", "120"))
+
+# Default for games which don't set simultaneous_turns
 SIMULTANEOUS_TURNS = os.environ.get("LLM_SERVER_SIMULTANEOUS_TURNS", "false").lower() == "true"
-turn_map = defaultdict(int)  # Initialize with 0 for any new key
-turn_count = 0
-turn_lock = threading.Lock()
 
-# Add after other global variables
-RESPONSE_POLL_INTERVAL = 0.1  # seconds
-RESPONSE_TIMEOUT = 60  # seconds
+# Default for games which don't set turn_deadline_seconds, agents which miss it forfeit the turn
+TURN_DEADLINE_SECONDS = float(os.environ.get("LLM_SERVER_TURN_DEADLINE_SECONDS", "60"))
+
+# How long usage requests, and budget checks, wait for responses still generating in the background
+BACKGROUND_GENERATIONS_WAIT_SECONDS = 60
+
+early_stop_stats = EarlyStopStats()
+
+# Seconds from process start until the server could serve requests, None until then
+startup_seconds = None
+
+# Served at /metrics, and written to ROOT_LOGS/llm_server_metrics.json at shutdown
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram("llm_request_seconds", "Time to respond to an agent request, including the turn barrier")
+requests_total = metrics.counter("llm_requests_total", "Agent requests by response status")
+requests_in_flight = metrics.gauge("llm_requests_in_flight", "Agent requests being handled")
+errors_total = metrics.counter("llm_errors_total", "Failed agent requests by error type")
+upstream_seconds = metrics.histogram("llm_upstream_seconds", "Time spent calling the provider, including retries and hedges")
+upstream_in_flight = metrics.gauge("llm_upstream_in_flight", "Requests being generated by the provider")
+barrier_wait_seconds_histogram = metrics.histogram("llm_barrier_wait_seconds", "Time responses are held at the turn barrier")
+turn_seconds = metrics.histogram("llm_turn_seconds", "Time from the start of a turn until it is released")
+forfeits_total = metrics.counter("llm_turn_forfeits_total", "Turns agents missed the deadline for")
+input_tokens_total = metrics.counter("llm_input_tokens_total", "Input tokens, including cached input tokens")
+cached_input_tokens_total = metrics.counter("llm_cached_input_tokens_total", "Input tokens read from the provider's prompt cache")
+output_tokens_total = metrics.counter("llm_output_tokens_total", "Output tokens")
+cost_usd_total = metrics.counter("llm_cost_usd_total", "Provider cost in USD, for models with known prices")
+admission_rejections_total = metrics.counter("llm_admission_rejections_total", "Agent requests rejected by admission control, by reason")
+compactions_total = metrics.counter("llm_compactions_total", "Requests whose compaction grew to fit the context window")
+scheduler_events = metrics.gauge("llm_scheduler_events", "Provider requests, retries and hedges since the server started")
 
 def setup_logging():
     logging.basicConfig(
@@ -65,123 +130,193 @@ def setup_logging():
 
 logger = setup_logging()
 
-def load_agent_configs(config_path):
-    global agent_configs
-    with open(config_path) as f:
-        loaded_configs = json.load(f)
-    logger.info(f"Loaded {len(loaded_configs)} agent configurations")
-
-    # Initialize turn map
+@dataclass
+class Game:
+    """The agents of one game, with their own turn barrier and interaction log"""
+    game_id: str
+    api_keys: list
+    turn_barrier: TurnBarrier
+    interaction_log: InteractionLog
+    simultaneous_turns: bool
+    log_dir: str
+    usage: dict = field(default_factory=dict)  # api_key -> UsageTotals
+    # Turn releases, agent requests and responses and the game ending, served at /games/<game_id>/events
+    events: EventFeed = field(default_factory=EventFeed)
+    # api_key -> generations still running after their response was returned, see finish_generation
+    background_generations: dict = field(default_factory=dict)
+
+    def usage_summary(self):
+        agents = []
+        total = UsageTotals()
+        for api_key in self.api_keys:
+            totals = self.usage.get(api_key, UsageTotals())
+            agents.append({"api_key": api_key, "name": agent_configs[api_key]['name'], **totals.to_dict()})
+            total.merge(totals)
+        return {"agents": agents, "total": total.to_dict()}
+
+class GameRegistrationError(Exception):
+    pass
+
+def register_game(game_id, loaded_configs, log_dir, simultaneous_turns=SIMULTANEOUS_TURNS, turn_deadline_seconds=TURN_DEADLINE_SECONDS):
+    """Add a game's agents to the server, raising GameRegistrationError if the game or an api key is already in use"""
+    if game_id in games:
+        raise GameRegistrationError(f"Game {game_id} already exists")
+    in_use = [api_key for api_key in loaded_configs if api_key in agent_configs]
+    if in_use:
+        raise GameRegistrationError(f"API keys already in use: {', '.join(in_use)}")
+
+    game_configs = {}
     for api_key, config in loaded_configs.items():
         if not 'provider' in config:
             logger.info(f"Skipping agent {api_key} because it has no provider")
             continue
-        agent_configs[api_key] = config
-    logger.info(f"Loaded {len(agent_configs)} agent configurations")
-
-def generate_claude_response(messages, model_name):
-    response = claude_client.messages.create(
-        max_tokens=8192,
-        messages=messages,
-        model=model_name,
-    )
-    return response.content[0].text
-
-def generate_openai_response(messages, model_name):
-    # Assumes using a reasoning model
-    response = openai_client.chat.completions.create(
-        model=model_name,
-        reasoning_effort="high",
-        messages=messages,
-    )
-    return response.choices[0].message.content
+        game_configs[api_key] = config
+    logger.info(f"Loaded {len(game_configs)} agent configurations for game {game_id}")
 
-def generate_openrouter_response(messages, model_name):
-    response = openrouter_client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-    )
-    return response.choices[0].message.content
-
-def generate_hyperbolic_response(messages, model_name):
-    response = hyperbolic_client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-    )
-    return response.choices[0].message.content
+    participants = []
+    for api_key, config in game_configs.items():
+        if config['provider'] in PROVIDERS:
+            participants.append(api_key)
+        else:
+            logger.error(f"Invalid provider specified: {config['provider']}")
 
-def generate_fireworks_response(messages, model_name):
-    response = fireworks_client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-    )
-    return response.choices[0].message.content
-
-def generate_gemini_response(messages, model_name):    
-    # Convert OpenAI-style messages to Gemini format
-    gemini_messages = [
-        {
-            "role": "model" if msg["role"] == "assistant" else "user",
-            "parts": [{
-                "text": msg["content"]
-            }]
-        }
-        for msg in messages
-    ]
-
-    # Assumes using a thinking model
-    chat = gemini_client.chats.create(
-        model=model_name,
-        config=types.GenerateContentConfig(
-            thinking_config=types.ThinkingConfig(include_thoughts=True),
-            http_options=types.HttpOptions(api_version='v1alpha'),
-        ),
-        history=gemini_messages[:-1]
+    # Build clients now so the first turn doesn't pay for importing the provider SDKs, and open
+    # a connection for each agent in the background so it doesn't pay for connecting either
+    agents_per_provider = Counter(config['provider'] for config in game_configs.values())
+    for provider, agent_count in sorted(agents_per_provider.items()):
+        try:
+            instance = get_provider(provider)
+        except InvalidProviderError:
+            logger.error(f"Invalid provider specified: {provider}")
+            continue
+        start_warm_up(instance, min(agent_count, get_scheduler(provider).config["max_in_flight"]))
+
+    os.makedirs(log_dir, exist_ok=True)
+    turns_path = os.path.join(log_dir, 'turns.jsonl')
+    def on_turn_release(record):
+        # Record each turn's start, deadline, release, arrivals and forfeits
+        turn_seconds.observe(record["released_at"] - record["started_at"], game=game_id)
+        for api_key in record["forfeits"]:
+            forfeits_total.inc(game=game_id, agent=game_configs[api_key]['name'])
+        with open(turns_path, 'a') as f:
+            f.write(json.dumps({
+                **record,
+                "forfeits": [game_configs[api_key]['name'] for api_key in record["forfeits"]],
+                "arrival_seconds": {game_configs[api_key]['name']: seconds for api_key, seconds in record["arrival_seconds"].items()},
+            }) + '\n')
+        game.events.publish("turn", turn_count=record["turn"] + 1, turn=record["turn"],
+                            started_at=record["started_at"], deadline_at=record["deadline_at"], released_at=record["released_at"],
+                            forfeits=[game_configs[api_key]['name'] for api_key in record["forfeits"]])
+
+    game = Game(
+        game_id=game_id,
+        api_keys=list(game_configs),
+        turn_barrier=TurnBarrier(participants, turn_deadline_seconds, on_release=on_turn_release),
+        interaction_log=InteractionLog(os.path.join(log_dir, 'llm_interactions.jsonl')),
+        simultaneous_turns=simultaneous_turns,
+        log_dir=log_dir,
     )
+    games[game_id] = game
+    for api_key, config in game_configs.items():
+        agent_configs[api_key] = config
+        game_by_key[api_key] = game
+    logger.info(f"Registered game {game_id} with {len(game.api_keys)} agents, logging to {log_dir}"
+                f"{f', turn deadline {turn_deadline_seconds}s' if simultaneous_turns else ''}")
+    return game
 
-    response = chat.send_message(gemini_messages[-1]["parts"][0]["text"])
-
-    return response.text
-
-def initialize_turn_map():
-    for api_key, config in agent_configs.items():
-        if config['provider'] == 'anthropic':
-            turn_map[api_key] = 0
-        elif config['provider'] == 'openai':
-            turn_map[api_key] = 0
-        elif config['provider'] == 'gemini':
-            turn_map[api_key] = 0
-        elif config['provider'] == 'openrouter':
-            turn_map[api_key] = 0
-        elif config['provider'] == 'hyperbolic':
-            turn_map[api_key] = 0
-        elif config['provider'] == 'fireworks':
-            turn_map[api_key] = 0
-        else:
-            logger.error(f"Invalid provider specified: {config['provider']}")
+def start_warm_up(provider, connections):
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        pending_warm_ups.append((provider, connections))
+        return
+    task = loop.create_task(provider.warm(connections))
+    warm_up_tasks.add(task)
+    task.add_done_callback(warm_up_tasks.discard)
+
+def end_game(game_id):
+    game = games.pop(game_id)
+    game.turn_barrier.close()
+    for api_key in game.api_keys:
+        agent_config = agent_configs.pop(api_key, None)
+        if agent_config is not None:
+            get_provider(agent_config['provider']).forget(api_key)
+        game_by_key.pop(api_key, None)
+        sessions.pop(api_key, None)
+        admission.forget(api_key)
+        context_compactor.forget(api_key)
+    write_metrics_summary(os.path.join(game.log_dir, 'llm_game_metrics.json'), game=game_id)
+    game.events.publish("game_end", turn_count=game.turn_barrier.turn_count)
+    game.events.close()
+    logger.info(f"Ended game {game_id} at turn {game.turn_barrier.turn_count}")
+
+def write_metrics_summary(path, **label_filter):
+    with open(path, 'w') as f:
+        json.dump(metrics.summary(**label_filter), f, indent=2)
+    logger.info(f"Wrote metrics summary to {path}")
+
+def collect_scheduler_metrics():
+    for provider, scheduler in schedulers.items():
+        for event, count in scheduler.stats.items():
+            scheduler_events.set(count, provider=provider, event=event)
+
+metrics.on_collect(collect_scheduler_metrics)
+
+def start_request(api_key, route):
+    """Count the request as in flight and publish it to the game's event feed, returning its start time"""
+    requests_in_flight.inc()
+    game_by_key[api_key].events.publish("request", agent=agent_configs[api_key]['name'], route=route)
+    return time.monotonic()
+
+def reject_request(api_key, route, rejection):
+    """Count a rejected request and return its error response"""
+    agent_config = agent_configs[api_key]
+    logger.warning(f"Rejected {route} request for {agent_config['name']}: {rejection.reason}")
+    admission_rejections_total.inc(game=game_by_key[api_key].game_id, agent=agent_config['name'], route=route, reason=rejection.reason)
+    headers = {}
+    if rejection.retry_after is not None:
+        headers["Retry-After"] = str(max(1, round(rejection.retry_after)))
+    return jsonify(rejection.to_dict()), rejection.status, headers
+
+def record_request(api_key, route, status, error_type, start_time):
+    requests_in_flight.dec()
+    agent_config = agent_configs.get(api_key)
+    game = game_by_key.get(api_key)
+    if agent_config is None or game is None:
+        # The game ended while the request was in flight
+        return
+    seconds = time.monotonic() - start_time
+    labels = {"game": game.game_id, "agent": agent_config['name'], "provider": agent_config['provider']}
+    request_seconds.observe(seconds, route=route, **labels)
+    requests_total.inc(route=route, status=str(status), **labels)
+    if error_type is not None:
+        errors_total.inc(type=error_type, **labels)
+    game.events.publish("response", agent=agent_config['name'], route=route, status=status, error_type=error_type, seconds=seconds)
 
-def mark_turn_complete(api_key):
-    with turn_lock:
-        turn_map[api_key] += 1
-
-def undo_turn(api_key):
-    with turn_lock:
-        turn_map[api_key] -= 1
-
-async def wait_for_all_responses(api_key):
-    global turn_count
-    start_time = time.time()
-    while time.time() - start_time < RESPONSE_TIMEOUT:
-        with turn_lock:
-            if min(turn_map.values()) == turn_count + 1:
-                # All agents complete advance the turn
-                turn_count += 1
-                return True
-            if turn_map[api_key] == turn_count:
-                # This agent is now unblocked
-                return True
-        await asyncio.sleep(RESPONSE_POLL_INTERVAL)
-    return False
+def load_agent_configs(config_path):
+    """Register the agents in the config file as the default game"""
+    with open(config_path) as f:
+        loaded_configs = json.load(f)
+    logger.info(f"Loaded {len(loaded_configs)} agent configurations")
+    return register_game(DEFAULT_GAME_ID, loaded_configs, os.environ.get('ROOT_LOGS', '.'))
+
+def get_scheduler(provider):
+    if provider not in schedulers:
+        schedulers[provider] = ProviderScheduler(provider, **scheduler_configs.get(provider, {}))
+    return schedulers[provider]
+
+@app.before_serving
+async def mark_ready():
+    global startup_seconds
+    startup_seconds = time.monotonic() - SERVER_START_TIME
+    logger.info(f"LLM server ready after {startup_seconds:.3f}s with providers: {', '.join(initialized_providers())}")
+    for provider, connections in pending_warm_ups:
+        start_warm_up(provider, connections)
+    pending_warm_ups.clear()
+
+@app.after_serving
+async def dump_metrics():
+    write_metrics_summary(os.path.join(os.environ.get('ROOT_LOGS', '.'), 'llm_server_metrics.json'))
 
 @app.before_request
 def setup():
@@ -191,12 +326,21 @@ def setup():
         # they're loaded when the server starts
         _configs_loaded = True
 
-@app.route('/generate', methods=['POST'])
-async def generate():
-    data = request.json
-    messages = data.get('messages', [])
+@app.before_request
+def admit_agent_request():
+    """Apply the per api key rate limit and body size cap before the body is read"""
     api_key = request.headers.get('X-Agent-API-Key')
+    if api_key not in agent_configs:
+        # Invalid keys are rejected by the route
+        return None
+    try:
+        admission.check_request(api_key, request.content_length)
+    except AdmissionRejected as e:
+        return reject_request(api_key, request.endpoint, e)
+    return None
 
+def check_request(api_key, messages):
+    """Return an error response for an invalid request, or None if it is valid"""
     if not api_key or api_key not in agent_configs:
         logger.warning(f"Invalid API key attempt: {api_key}")
         return jsonify({"error": "Invalid or missing API key"}), 401
@@ -205,79 +349,605 @@ async def generate():
         logger.warning("Request received with no messages")
         return jsonify({"error": "No messages provided"}), 400
 
+    return None
+
+async def generate_response(api_key, messages, on_event=None):
+    """
+    Generate, cache and log a response for the agent.
+
+    If on_event is given it is called with "delta" events as the response
+    streams, and a "code" event as soon as the first python block is complete.
+    Text past the early stop cutoff is never sent.
+    """
     agent_config = agent_configs[api_key]
-    logger.info(f"Generating response for agent: {agent_config['name']}, using model: {agent_config['model']}")
-    
-    try:
-        # Log the request details before processing
-        logger.info(f"Request details for {agent_config['name']}:")
-        logger.info(f"API key: {api_key}")
-        logger.info(f"Provider: {agent_config['provider']}")
-        logger.info(f"Model: {agent_config['model']}")
-        logger.info(f"Messages: {json.dumps(messages, indent=2)}")
-        
-        if agent_config['provider'] == 'anthropic':
-            response_text = generate_claude_response(messages, agent_config['model'])
-        elif agent_config['provider'] == 'openai':
-            response_text = generate_openai_response(messages, agent_config['model'])
-        elif agent_config['provider'] == 'gemini':
-            response_text = generate_gemini_response(messages, agent_config['model'])
-        elif agent_config['provider'] == 'openrouter':
-            response_text = generate_openrouter_response(messages, agent_config['model'])
-        elif agent_config['provider'] == 'hyperbolic':
-            response_text = generate_hyperbolic_response(messages, agent_config['model'])
-        elif agent_config['provider'] == 'fireworks':
-            response_text = generate_fireworks_response(messages, agent_config['model'])
+    game = game_by_key[api_key]
+    provider = get_provider(agent_config['provider'])
+    # The model is sent the compacted messages, the log and cache use the agent's messages
+    sent_messages, compaction = context_compactor.compact(api_key, messages, agent_config, provider)
+    if compaction is not None:
+        log = logger.info if compaction["grew"] else logger.debug
+        log(f"Compacted request for {agent_config['name']}: {compaction}")
+        if compaction["grew"]:
+            compactions_total.inc(game=game.game_id, agent=agent_config['name'], model=agent_config['model'])
+    totals = game.usage.setdefault(api_key, UsageTotals())
+    if agent_config.get('budget') and game.background_generations.get(api_key):
+        # The agent's last responses only count against its budget once they finish
+        await asyncio.wait(set(game.background_generations[api_key]), timeout=BACKGROUND_GENERATIONS_WAIT_SECONDS)
+    check_budget(agent_config, totals, sent_messages)
+    logger.info(f"Generating response for agent: {agent_config['name']} in game {game.game_id}, using model: {agent_config['model']}")
+
+    # Log the request details before processing
+    logger.info(f"Request details for {agent_config['name']}:")
+    logger.info(f"API key: {api_key}")
+    logger.info(f"Provider: {agent_config['provider']}")
+    logger.info(f"Model: {agent_config['model']}")
+    # Only log the messages added since the last logged turn, the full history is rebuilt from llm_interactions.jsonl
+    offset = game.interaction_log.offset(api_key, messages)
+    logger.info(f"New messages from offset {offset}: {json.dumps(messages[offset:], indent=2)}")
+
+    # Stop generation once the first python block and its reasoning summary are complete,
+    # agents ignore anything after it. Can be disabled with "early_stop": false in the agent config.
+    # A sample of responses, and those for agents with a budget, aren't stopped but are still returned
+    # at the cutoff, so the provider reports their usage. See EarlyStopStats.
+    cutoff = CodeBlockCutoff()
+    early_stop = agent_config.get('early_stop', True)
+    cutoff_reached = asyncio.Event()
+    finish_in_background = False
+    sent = {"text": 0, "code": False}
+    def on_delta(delta):
+        reached = cutoff.feed(delta) and early_stop
+        if reached:
+            cutoff_reached.set()
+        if on_event is not None:
+            end = cutoff.cutoff if reached else len(cutoff.text)
+            if end > sent["text"]:
+                on_event({"type": "delta", "text": cutoff.text[sent["text"]:end]})
+                sent["text"] = end
+            if not sent["code"] and cutoff.code is not None:
+                on_event({"type": "code", "code": cutoff.code})
+                sent["code"] = True
+        return reached and not finish_in_background
+
+    response_text = response_cache.lookup(agent_config['provider'], agent_config['model'], messages)
+    cached = response_text is not None
+    early_stop_report = None
+    if cached:
+        logger.info(f"Replaying cached response for {agent_config['name']}")
+        on_delta(response_text)
+        # Replayed responses don't call the provider
+        usage = Usage(input_tokens=0, output_tokens=0)
+        cost = 0.0
+        record_usage(game, api_key, agent_config, usage, cost)
+    else:
+        if early_stop:
+            sample = early_stop_stats.should_sample(agent_config['model'])
+            # Usage for a stream stopped early is estimated, and misses tokens spent reasoning
+            finish_in_background = sample or bool(agent_config.get('budget'))
+        generation = asyncio.create_task(generate_upstream(api_key, agent_config, provider, sent_messages, on_delta))
+        # Waits until the generation finishes, or reaches its cutoff if it will finish in the background
+        waiting = {generation, asyncio.create_task(cutoff_reached.wait())} if finish_in_background else {generation}
+        try:
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            generation.cancel()
+            raise
+        finally:
+            for task in waiting - {generation}:
+                task.cancel()
+
+        if not generation.done():
+            # The cutoff was reached: return the response now and let the rest generate in the background,
+            # its usage is only added to the totals once the provider reports it
+            response_text = cutoff.text[:cutoff.cutoff]
+            early_stop_report = {"stopped_early": False, "finished_in_background": True, "sample": sample}
+            usage = Usage()
+            fill_usage_estimates(agent_config, provider, sent_messages, response_text, usage)
+            task = asyncio.create_task(finish_generation(game, api_key, agent_config, provider, generation, cutoff, sent_messages))
+            pending = game.background_generations.setdefault(api_key, set())
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            cost = None
         else:
-            logger.error(f"Invalid provider specified: {agent_config['provider']}")
-            return jsonify({"error": "Invalid provider"}), 400
-
-        # Log the messages and response
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "agent_name": agent_config['name'],
-            "api_key": api_key,
-            "messages": messages,
-            "response": response_text
-        }
-        
-        with open(os.path.join(os.environ.get('ROOT_LOGS'), 'llm_interactions.jsonl'), 'a') as f:
-            f.write(json.dumps(log_entry) + '\n')
-
-        # Handle simultaneous turns if enabled
-        if SIMULTANEOUS_TURNS:
-            mark_turn_complete(api_key)
-            logger.debug(f"Marked turn complete for agent {agent_config['name']}")
-            
-            if await wait_for_all_responses(api_key):
-                logger.info(f"All agents responded for turn, returning response for {agent_config['name']}")
-                return jsonify({"text": response_text})
+            completion = generation.result()
+            if completion.stopped_early:
+                # The last streamed chunk can run past the cutoff
+                response_text = completion.text[:cutoff.cutoff]
             else:
-                logger.warning(f"Timeout waiting for other agents' responses")
-                undo_turn(api_key)
-                return jsonify({
-                    "error": "Timeout waiting for other agents' responses"
-                }), 408
-        else:
-            # Normal single-response mode
-            return jsonify({"text": response_text})
+                response_text = completion.text
+                early_stop_stats.record_sample(agent_config['model'], cutoff, time.monotonic())
+            early_stop_report = early_stop_stats.record(agent_config['model'], cutoff, completion.stopped_early)
+            usage = completion.usage
+            fill_usage_estimates(agent_config, provider, sent_messages, completion.text, usage)
+            context_compactor.record_usage(agent_config, sent_messages, usage)
+            cost = usage_cost(usage, model_prices(agent_config))
+            record_usage(game, api_key, agent_config, usage, cost)
+        logger.info(f"Early stop for {agent_config['name']}: {early_stop_report}")
+        response_cache.store(agent_config['provider'], agent_config['model'], messages, response_text)
+
+    # Log the new messages and response
+    game.interaction_log.append(api_key, agent_config['name'], messages, response_text,
+                                provider=agent_config['provider'], model=agent_config['model'], cached=cached,
+                                early_stop=early_stop_report, usage=usage.to_dict(), cost_usd=cost, compaction=compaction)
+    return response_text, usage
+
+async def generate_upstream(api_key, agent_config, provider, sent_messages, on_delta):
+    """Call the provider under its scheduler's limits"""
+    upstream_start_time = time.monotonic()
+    upstream_in_flight.inc(provider=agent_config['provider'])
+    try:
+        return await get_scheduler(agent_config['provider']).run(
+            agent_config['model'],
+            lambda attempt_on_delta: provider.generate(sent_messages, agent_config, attempt_on_delta, api_key=api_key),
+            on_delta,
+        )
+    finally:
+        upstream_in_flight.dec(provider=agent_config['provider'])
+        upstream_seconds.observe(time.monotonic() - upstream_start_time,
+                                 provider=agent_config['provider'], model=agent_config['model'])
+
+async def finish_generation(game, api_key, agent_config, provider, generation, cutoff, sent_messages):
+    """Wait for a response returned at its cutoff to finish generating, then record what was generated after the cutoff and its usage"""
+    try:
+        completion = await generation
+    except Exception as e:
+        logger.warning(f"Response for {agent_config['name']} failed after its cutoff: {e}")
+        return
+    tail = early_stop_stats.record_sample(agent_config['model'], cutoff, time.monotonic())
+    logger.info(f"Response for {agent_config['name']} finished in the background, generated after the cutoff: {tail}")
+    usage = completion.usage
+    fill_usage_estimates(agent_config, provider, sent_messages, completion.text, usage)
+    context_compactor.record_usage(agent_config, sent_messages, usage)
+    record_usage(game, api_key, agent_config, usage, usage_cost(usage, model_prices(agent_config)))
+
+def fill_usage_estimates(agent_config, provider, sent_messages, text, usage):
+    """
+    Estimate the token counts the provider didn't report, e.g. for a stream stopped early.
+
+    Output tokens are estimated as the text's tokens plus the tokens the model
+    spends beyond its text, e.g. on reasoning, learned from reported counts.
+    """
+    counter = context_compactor.counter(agent_config, provider)
+    if usage.input_tokens is None:
+        usage.input_tokens = counter.count(sent_messages)
+        usage.estimated = True
+    text_tokens = counter.count_text(text)
+    if usage.output_tokens is None:
+        usage.output_tokens = text_tokens + early_stop_stats.hidden_tokens(agent_config['model'])
+        usage.estimated = True
+    else:
+        early_stop_stats.record_output_tokens(agent_config['model'], usage.output_tokens, text_tokens)
+
+def record_usage(game, api_key, agent_config, usage, cost):
+    """Add a call's usage to the agent's totals and the token metrics"""
+    totals = game.usage.setdefault(api_key, UsageTotals())
+    totals.add(usage, cost)
+    logger.info(f"Usage for {agent_config['name']}: {usage.input_tokens} input tokens "
+                f"({usage.cached_input_tokens} cached, {usage.cache_write_tokens} cache writes, {usage.uncached_input_tokens} uncached), "
+                f"{usage.output_tokens} output tokens{' (estimated)' if usage.estimated else ''}, "
+                f"cost {'unknown' if cost is None else f'${cost:.4f}'}, totals {totals.to_dict()}")
+
+    token_labels = {"game": game.game_id, "agent": agent_config['name'], "provider": agent_config['provider'], "model": agent_config['model']}
+    input_tokens_total.inc(usage.input_tokens, **token_labels)
+    cached_input_tokens_total.inc(usage.cached_input_tokens, **token_labels)
+    output_tokens_total.inc(usage.output_tokens, **token_labels)
+    if cost is not None:
+        cost_usd_total.inc(cost, **token_labels)
+
+async def wait_for_turn(api_key):
+    """
+    In simultaneous turn mode, wait for all agents to complete the turn or its deadline to pass.
+
+    Returns (turn, seconds waited at the turn barrier). The turn is None, and
+    the wait 0, when simultaneous turns are disabled.
+    """
+    game = game_by_key[api_key]
+    if not game.simultaneous_turns:
+        return None, 0.0
+    agent_config = agent_configs[api_key]
+    turn, barrier_wait_seconds = await game.turn_barrier.wait(api_key)
+    logger.info(f"Turn {turn} released, returning response for {agent_config['name']} after waiting {barrier_wait_seconds:.3f}s at the turn barrier")
+    barrier_wait_seconds_histogram.observe(barrier_wait_seconds, game=game.game_id, agent=agent_config['name'])
+    return turn, barrier_wait_seconds
+
+async def respond(api_key, messages, on_success=None):
+    """Generate a JSON response, calling on_success with the response text if it is returned to the agent"""
+    agent_config = agent_configs[api_key]
+    try:
+        admission.start_generation(api_key)
+    except AdmissionRejected as e:
+        return reject_request(api_key, "generate", e)
+    start_time = start_request(api_key, "generate")
+    # Stays as cancelled if the agent disconnects
+    status, error_type = 499, "cancelled"
+    try:
+        response_text, usage = await generate_response(api_key, messages)
+
+        turn, barrier_wait_seconds = await wait_for_turn(api_key)
+        if on_success is not None:
+            on_success(response_text)
+        status, error_type = 200, None
+        return jsonify({"text": response_text, "turn": turn, "barrier_wait_seconds": barrier_wait_seconds, "usage": usage.to_dict(),
+                        "server_seconds": time.monotonic() - start_time})
+    except InvalidProviderError:
+        status, error_type = 400, "invalid_provider"
+        return jsonify({"error": "Invalid provider"}), 400
+    except BudgetExceededError as e:
+        logger.warning(f"Rejected request for {agent_config['name']}: {e}")
+        status, error_type = 402, "budget_exceeded"
+        return jsonify({"error": "Budget exceeded", "budget": e.to_dict()}), 402
     except Exception as e:
         logger.error(f"Error generating response for {agent_config['name']} with {agent_config['provider']}: {str(e)}", exc_info=True)
+        status, error_type = 500, type(e).__name__
         return jsonify({"error": str(e)}), 500
+    finally:
+        admission.end_generation(api_key)
+        record_request(api_key, "generate", status, error_type, start_time)
+
+async def respond_stream(api_key, messages, on_success=None):
+    """
+    Generate a streamed response of newline delimited JSON events:
+
+        {"type": "delta", "text": ...}  streamed response text
+        {"type": "code", "code": ...}   the first python block, as soon as it is complete
+        {"type": "commit"}              the agent may act on the code
+        {"type": "done", "text": ..., "turn": ..., "barrier_wait_seconds": ..., "usage": ..., "server_seconds": ...}
+        {"type": "error", "error": ..., "status": ...}
+
+    The code can be prefetched as soon as it arrives, but in simultaneous turn
+    mode the commit is held until the turn barrier releases. Otherwise it is
+    sent with the code.
+    """
+    agent_config = agent_configs[api_key]
+    try:
+        admission.start_generation(api_key)
+    except AdmissionRejected as e:
+        return reject_request(api_key, "generate_stream", e)
+    simultaneous_turns = game_by_key[api_key].simultaneous_turns
+    queue = asyncio.Queue()
+    committed = False
+
+    def on_event(event):
+        nonlocal committed
+        queue.put_nowait(event)
+        if event["type"] == "code" and not simultaneous_turns:
+            queue.put_nowait({"type": "commit"})
+            committed = True
+
+    async def produce():
+        start_time = start_request(api_key, "generate_stream")
+        # Stays as cancelled if the agent disconnects
+        status, error_type = 499, "cancelled"
+        try:
+            response_text, usage = await generate_response(api_key, messages, on_event)
+            turn, barrier_wait_seconds = await wait_for_turn(api_key)
+            if on_success is not None:
+                on_success(response_text)
+            if not committed:
+                queue.put_nowait({"type": "commit"})
+            status, error_type = 200, None
+            queue.put_nowait({"type": "done", "text": response_text, "turn": turn, "barrier_wait_seconds": barrier_wait_seconds, "usage": usage.to_dict(),
+                              "server_seconds": time.monotonic() - start_time})
+        except InvalidProviderError:
+            status, error_type = 400, "invalid_provider"
+            queue.put_nowait({"type": "error", "error": "Invalid provider", "status": 400})
+        except BudgetExceededError as e:
+            logger.warning(f"Rejected request for {agent_config['name']}: {e}")
+            status, error_type = 402, "budget_exceeded"
+            queue.put_nowait({"type": "error", "error": "Budget exceeded", "budget": e.to_dict(), "status": 402})
+        except Exception as e:
+            logger.error(f"Error generating response for {agent_config['name']} with {agent_config['provider']}: {str(e)}", exc_info=True)
+            status, error_type = 500, type(e).__name__
+            queue.put_nowait({"type": "error", "error": str(e), "status": 500})
+        finally:
+            admission.end_generation(api_key)
+            record_request(api_key, "generate_stream", status, error_type, start_time)
+            queue.put_nowait(None)
+
+    # Started now rather than when the response is first read, so the generation slot
+    # is released even if the agent disconnects before the stream starts
+    task = asyncio.create_task(produce())
+
+    async def stream_events():
+        try:
+            while (event := await queue.get()) is not None:
+                yield json.dumps(event) + "\n"
+        finally:
+            task.cancel()
+
+    response = await make_response(stream_events(), 200, {"Content-Type": "application/x-ndjson"})
+    # Generation and the turn barrier can take longer than Quart's default response timeout
+    response.timeout = None
+    return response
+
+@app.route('/generate', methods=['POST'])
+async def generate():
+    data = await request.get_json()
+    messages = data.get('messages', [])
+    api_key = request.headers.get('X-Agent-API-Key')
+
+    error_response = check_request(api_key, messages)
+    if error_response is not None:
+        return error_response
+
+    return await respond(api_key, messages)
+
+@app.route('/generate_stream', methods=['POST'])
+async def generate_stream():
+    """Streaming variant of /generate, see respond_stream for the events"""
+    data = await request.get_json()
+    messages = data.get('messages', [])
+    api_key = request.headers.get('X-Agent-API-Key')
+
+    error_response = check_request(api_key, messages)
+    if error_response is not None:
+        return error_response
+
+    return await respond_stream(api_key, messages)
+
+@dataclass
+class Session:
+    """Conversation history held by the server, so agents only send new messages"""
+    session_id: str
+    api_key: str
+    messages: list = field(default_factory=list)
+    # Approximate size of the history in bytes, capped by admission control
+    size: int = 0
+
+    def extend(self, messages):
+        """Append messages, raising AdmissionRejected if the history would grow too large"""
+        size = self.size + len(json.dumps(messages))
+        admission.check_session_size(size)
+        self.messages.extend(messages)
+        self.size = size
+
+def get_session(session_id, api_key, data, generate=False):
+    """
+    Look up the agent's session and append the request's new messages to it.
+
+    The request's offset must match the session length, so a client whose view
+    of the history has diverged gets a 409 and can reopen the session. If
+    generate is set, a request made while the agent already has a generation
+    in flight is rejected before its messages are appended. Returns
+    (session, None) or (None, error response).
+    """
+    if not api_key or api_key not in agent_configs:
+        logger.warning(f"Invalid API key attempt: {api_key}")
+        return None, (jsonify({"error": "Invalid or missing API key"}), 401)
+
+    session = sessions.get(api_key)
+    if session is None or session.session_id != session_id:
+        return None, (jsonify({"error": "Unknown session"}), 404)
+
+    offset = data.get('offset', len(session.messages))
+    if offset != len(session.messages):
+        logger.warning(f"Session offset mismatch for {api_key}: expected {len(session.messages)}, got {offset}")
+        return None, (jsonify({"error": "Session offset mismatch", "length": len(session.messages)}), 409)
+
+    try:
+        if generate:
+            admission.check_generation(api_key)
+        session.extend(data.get('messages', []))
+    except AdmissionRejected as e:
+        return None, reject_request(api_key, request.endpoint, e)
+    return session, None
+
+def append_response(session):
+    def on_success(response_text):
+        # Responses are bounded by the provider's output limit, so aren't checked against the session size cap
+        message = {"role": "assistant", "content": response_text}
+        session.messages.append(message)
+        session.size += len(json.dumps(message))
+    return on_success
+
+@app.route('/sessions', methods=['POST'])
+async def open_session():
+    """Open a new session for the agent, replacing any existing one, with optional initial messages"""
+    data = await request.get_json()
+    api_key = request.headers.get('X-Agent-API-Key')
+    if not api_key or api_key not in agent_configs:
+        logger.warning(f"Invalid API key attempt: {api_key}")
+        return jsonify({"error": "Invalid or missing API key"}), 401
+
+    session = Session(session_id=uuid.uuid4().hex, api_key=api_key)
+    try:
+        session.extend(list(data.get('messages', [])))
+    except AdmissionRejected as e:
+        return reject_request(api_key, "open_session", e)
+    sessions[api_key] = session
+    logger.info(f"Opened session {session.session_id} for {agent_configs[api_key]['name']} with {len(session.messages)} messages")
+    return jsonify({"session_id": session.session_id, "length": len(session.messages)})
+
+@app.route('/sessions/<session_id>/messages', methods=['POST'])
+async def append_session_messages(session_id):
+    data = await request.get_json()
+    api_key = request.headers.get('X-Agent-API-Key')
+    session, error_response = get_session(session_id, api_key, data)
+    if error_response is not None:
+        return error_response
+    return jsonify({"length": len(session.messages)})
+
+@app.route('/sessions/<session_id>/generate', methods=['POST'])
+async def generate_session(session_id):
+    """Append the new messages to the session and generate a response from the full history"""
+    data = await request.get_json()
+    api_key = request.headers.get('X-Agent-API-Key')
+    session, error_response = get_session(session_id, api_key, data, generate=True)
+    if error_response is None:
+        error_response = check_request(api_key, session.messages)
+    if error_response is not None:
+        return error_response
+
+    return await respond(api_key, list(session.messages), append_response(session))
+
+@app.route('/sessions/<session_id>/generate_stream', methods=['POST'])
+async def generate_session_stream(session_id):
+    """Streaming variant of /sessions/<session_id>/generate"""
+    data = await request.get_json()
+    api_key = request.headers.get('X-Agent-API-Key')
+    session, error_response = get_session(session_id, api_key, data, generate=True)
+    if error_response is None:
+        error_response = check_request(api_key, session.messages)
+    if error_response is not None:
+        return error_response
+
+    return await respond_stream(api_key, list(session.messages), append_response(session))
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    """Metrics in the Prometheus text format. Needs the admin token, as per agent timings would let agents watch each other's turns"""
+    error_response = check_admin_token()
+    if error_response is not None:
+        return error_response
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    """
+    Readiness check, game.py waits on this before starting agents. Providers
+    are reported with their warm-up state (cold, warming, ready or failed),
+    connections opened and warm-up seconds, see Provider.warm.
+    """
+    return jsonify({
+        "ready": startup_seconds is not None,
+        "startup_seconds": startup_seconds,
+        "providers": provider_health(),
+        "games": len(games),
+    }), 200 if startup_seconds is not None else 503
+
+def check_admin_token():
+    """Return an error response unless the request has the admin token, or None if it does"""
+    if ADMIN_TOKEN is None:
+        return jsonify({"error": "Game registration is disabled, set LLM_SERVER_ADMIN_TOKEN to enable it"}), 403
+    # Browsers' EventSource can't set headers, so the token can also be passed as a query parameter
+    if (request.headers.get('X-Admin-Token') or request.args.get('token')) != ADMIN_TOKEN:
+        logger.warning("Invalid admin token attempt")
+        return jsonify({"error": "Invalid or missing admin token"}), 401
+    return None
+
+@app.route('/games', methods=['POST'])
+async def create_game():
+    """
+    Register a game's agents with the server.
+
+    Takes {"agent_configs": {api_key: config}, "game_id": optional, "log_dir": optional,
+    "simultaneous_turns": optional, "turn_deadline_seconds": optional}. Interaction
+    and turn logs are written to log_dir, which defaults to ROOT_LOGS/<game_id>.
+    """
+    error_response = check_admin_token()
+    if error_response is not None:
+        return error_response
+
+    data = await request.get_json()
+    game_id = data.get('game_id') or uuid.uuid4().hex
+    log_dir = data.get('log_dir') or os.path.join(os.environ.get('ROOT_LOGS', '.'), game_id)
+    try:
+        game = register_game(game_id, data.get('agent_configs', {}), log_dir,
+                             data.get('simultaneous_turns', SIMULTANEOUS_TURNS),
+                             data.get('turn_deadline_seconds', TURN_DEADLINE_SECONDS))
+    except GameRegistrationError as e:
+        logger.warning(f"Failed to register game {game_id}: {e}")
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"game_id": game.game_id, "agents": len(game.api_keys)})
+
+@app.route('/games/<game_id>', methods=['DELETE'])
+async def delete_game(game_id):
+    """End a game, its api keys and sessions stop working"""
+    error_response = check_admin_token()
+    if error_response is not None:
+        return error_response
+    if game_id not in games:
+        return jsonify({"error": "Unknown game"}), 404
+    end_game(game_id)
+    return jsonify({"game_id": game_id})
+
+@app.route('/games/<game_id>/usage', methods=['GET'])
+async def get_game_usage(game_id):
+    """Token and cost totals per agent and for the game"""
+    error_response = check_admin_token()
+    if error_response is not None:
+        return error_response
+    game = games.get(game_id)
+    if game is None:
+        return jsonify({"error": "Unknown game"}), 404
+    pending = set().union(*game.background_generations.values())
+    if pending:
+        # Their usage is only added once they finish
+        await asyncio.wait(pending, timeout=BACKGROUND_GENERATIONS_WAIT_SECONDS)
+    return jsonify(game.usage_summary())
+
+@app.route('/games/<game_id>/events', methods=['GET'])
+async def game_events(game_id):
+    """
+    Server-sent events for the game, each a JSON object with an "id", "type" and "time":
+
+        turn: a turn was released, with the new turn_count, its timings and forfeits
+        request: an agent's request started
+        response: an agent's request finished, with its status and seconds taken
+        game_end: the game ended, the stream closes after it
+
+    Reconnecting clients can send Last-Event-ID to resume after the events they saw.
+    """
+    error_response = check_admin_token()
+    if error_response is not None:
+        return error_response
+    game = games.get(game_id)
+    if game is None:
+        return jsonify({"error": "Unknown game"}), 404
+
+    try:
+        last_id = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID must be an event id"}), 400
+
+    async def stream_events():
+        async for event in game.events.subscribe(last_id):
+            if event is None:
+                # Keeps idle connections open through proxies, and detects closed ones
+                yield ": keepalive\n\n"
+            else:
+                yield f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+
+    response = await make_response(stream_events(), 200, {"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    response.timeout = None
+    return response
+
+@app.route('/games/<game_id>/turn_count', methods=['GET'])
+async def get_game_turn_count(game_id):
+    game = games.get(game_id)
+    if game is None:
+        return jsonify({"error": "Unknown game"}), 404
+    return jsonify({"turn_count": game.turn_barrier.turn_count})
 
 @app.route('/turn_count', methods=['GET'])
-def get_turn_count():
-    return jsonify({"turn_count": turn_count})
+async def get_turn_count():
+    """Turn count of the default game"""
+    return await get_game_turn_count(DEFAULT_GAME_ID)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('--api-key-config', required=True,
-                       help='Path to JSON file containing API key configurations')
+    parser.add_argument('--api-key-config', default=None,
+                       help='Path to JSON file containing API key configurations, served as the default game. '
+                            'Without it games are registered with POST /games')
+    parser.add_argument('--port', type=int, default=5000,
+                       help='Port to listen on')
+    parser.add_argument('--uds', default=None,
+                       help='Also listen on this unix domain socket, agents use it when LLM_SERVER_SOCKET is set')
     args = parser.parse_args()
     
     # Load API key configs from the provided file
-    load_agent_configs(args.api_key_config)
-    initialize_turn_map()
+    if args.api_key_config is not None:
+        load_agent_configs(args.api_key_config)
     
-    logger.info("Starting LLM server on port 5000")
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    logger.info(f"Starting LLM server on port {args.port}{f' and unix socket {args.uds}' if args.uds else ''}")
+    # Single process ASGI server, all requests are handled on one event loop
+    config = uvicorn.Config(app, host='0.0.0.0', port=args.port, log_config=None, timeout_keep_alive=KEEP_ALIVE_SECONDS)
+    sockets = [config.bind_socket()]
+    if args.uds:
+        if os.path.exists(args.uds):
+            os.remove(args.uds)
+        unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix_socket.bind(args.uds)
+        # Agents run as another user, and are authenticated by their api key as over TCP
+        os.chmod(args.uds, 0o666)
+        sockets.append(unix_socket)
+    uvicorn.Server(config).run(sockets=sockets)
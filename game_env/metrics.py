@@ -0,0 +1,169 @@
+import bisect
+import math
+
+# Upper bounds in seconds, covering fast local calls up to slow reasoning models
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in self._values.items()]
+
+    def keys(self):
+        return list(self._values)
+
+    def summary(self, key):
+        return self._values[key]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self._values[_label_key(labels)] = value
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {}  # label key -> {"counts": per bucket counts, "sum", "count", "max"}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0, "max": 0.0}
+        series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+        series["sum"] += value
+        series["count"] += 1
+        series["max"] = max(series["max"], value)
+
+    def render(self):
+        lines = []
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+    def keys(self):
+        return list(self._series)
+
+    def quantile(self, key, q):
+        """Estimate a quantile by interpolating within its bucket, as Prometheus' histogram_quantile does"""
+        series = self._series[key]
+        rank = q * series["count"]
+        cumulative = 0
+        for idx, (bound, count) in enumerate(zip(self.buckets, series["counts"])):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[idx - 1] if idx > 0 else 0.0
+                upper = min(bound, series["max"])
+                return lower + (max(upper, lower) - lower) * (rank - cumulative) / count
+            cumulative += count
+        return series["max"]
+
+    def summary(self, key):
+        series = self._series[key]
+        return {
+            "count": series["count"],
+            "sum": series["sum"],
+            "mean": series["sum"] / series["count"],
+            "p50": self.quantile(key, 0.5),
+            "p95": self.quantile(key, 0.95),
+            "p99": self.quantile(key, 0.99),
+            "max": series["max"],
+        }
+
+class MetricsRegistry:
+    """
+    In-process metrics, rendered in the Prometheus text format for /metrics
+    and summarised as JSON for the logs.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self._add(Gauge(name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def on_collect(self, collector):
+        """Call collector before rendering or summarising, to update metrics kept elsewhere"""
+        self._collectors.append(collector)
+
+    def _collect(self):
+        for collector in self._collectors:
+            collector()
+
+    def render(self):
+        self._collect()
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self, **label_filter):
+        """
+        Return {metric name: [{"labels": ..., "value": ...}]}, histograms
+        summarised as count, sum, mean, p50, p95, p99 and max. Only series
+        with all the given label values are included.
+        """
+        self._collect()
+        result = {}
+        for metric in self._metrics.values():
+            entries = []
+            for key in metric.keys():
+                labels = dict(key)
+                if any(labels.get(name) != value for name, value in label_filter.items()):
+                    continue
+                entries.append({"labels": labels, "value": metric.summary(key)})
+            if entries:
+                result[metric.name] = entries
+        return result
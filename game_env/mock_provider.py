@@ -0,0 +1,112 @@
+import asyncio
+import math
+import random
+
+from completion import Completion
+from context_window import turn_starts
+
+# Latency profiles for mock models, in seconds. Latencies are sampled from a
+# lognormal distribution fitted to the p50 and p99.
+LATENCY_PROFILES = {
+    "mock-fast": {"p50": 1.0, "p99": 4.0},
+    "mock-chat": {"p50": 5.0, "p99": 20.0},
+    "mock-reasoning": {"p50": 25.0, "p99": 90.0},
+}
+
+# z-score of the 99th percentile of a standard normal distribution
+P99_Z_SCORE = 2.3263
+
+KILL_AGENTS_CODE = """
+import os
+import psutil
+
+me = psutil.Process(os.getpid())
+agent = me.parent()
+
+# Don't kill our own agent process tree
+own_pids = {me.pid} | {p.pid for p in me.parents()} | {p.pid for p in agent.children(recursive=True)}
+
+for proc in psutil.process_iter(['pid', 'cmdline']):
+    cmdline = ' '.join(proc.info['cmdline'] or [])
+    if proc.info['pid'] in own_pids or 'agent_' not in cmdline or '.py' not in cmdline:
+        continue
+    try:
+        proc.kill()
+        print(f"Killed {proc.info['pid']}: {cmdline}")
+    except psutil.Error as e:
+        print(f"Failed to kill {proc.info['pid']}: {e}")
+""".strip()
+
+SLEEP_CODE = """
+import time
+
+while True:
+    print("Sleeping")
+    time.sleep(10)
+""".strip()
+
+# Bounded to 2**8 processes so load tests don't take down the container
+FORK_BOMB_CODE = """
+import os
+import time
+
+for _ in range(8):
+    os.fork()
+print(f"Forked process {os.getpid()}")
+time.sleep(60)
+""".strip()
+
+STRATEGIES = {
+    "kill_agents": ("Find every agent_*.py process outside my own process tree and kill it.", KILL_AGENTS_CODE),
+    "sleep": ("Nothing to do this turn, spawn a process which sleeps.", SLEEP_CODE),
+    "fork_bomb": ("Flood the process table so the other agent struggles to act.", FORK_BOMB_CODE),
+}
+
+class MockProviderError(Exception):
+    """Injected error, reported as overloaded so the scheduler retries it"""
+    status_code = 529
+
+class MockProvider:
+    """
+    Offline provider which returns scripted strategies after a sampled latency.
+
+    Agent configs using the mock provider can set:
+        model: one of LATENCY_PROFILES
+        strategies: list of STRATEGIES keys, one per turn, the last one repeats (default: ["kill_agents"])
+        latency: {"p50": seconds, "p99": seconds} overriding the model's profile
+        seed: seed for the latency sampling
+        error_rate: probability of failing a request with an overloaded error (default: 0)
+    """
+
+    def __init__(self):
+        self._rngs = {}
+
+    def sample_latency(self, agent_config):
+        profile = agent_config.get("latency") or LATENCY_PROFILES[agent_config["model"]]
+        mu = math.log(profile["p50"])
+        sigma = (math.log(profile["p99"]) - mu) / P99_Z_SCORE
+        return self._rng(agent_config).lognormvariate(mu, sigma)
+
+    def _rng(self, agent_config):
+        return self._rngs.setdefault(agent_config.get("api_key", agent_config["name"]), random.Random(agent_config.get("seed")))
+
+    async def generate(self, messages, agent_config, on_delta):
+        strategies = agent_config.get("strategies", ["kill_agents"])
+        # Agents send the game prompt, its reply and their first observation on the first turn
+        turn = max(len(turn_starts(messages)) - 1, 0)
+        strategy = strategies[min(turn, len(strategies) - 1)]
+        summary, code = STRATEGIES[strategy]
+
+        latency = self.sample_latency(agent_config)
+        if self._rng(agent_config).random() < agent_config.get("error_rate", 0):
+            await asyncio.sleep(latency / 2)
+            raise MockProviderError(f"Mock {agent_config['model']} overloaded")
+        await asyncio.sleep(latency)
+
+        # Stream the response a line at a time so early stopping is exercised
+        chunks = []
+        for line in f"{summary}\n\n```python\n{code}\n```\n\nThis should win the game.".splitlines(keepends=True):
+            chunks.append(line)
+            if on_delta(line):
+                return Completion("".join(chunks), stopped_early=True)
+        return Completion("".join(chunks))
@@ -0,0 +1,365 @@
+import asyncio
+import logging
+import os
+import time
+
+from completion import Completion, Usage
+
+logger = logging.getLogger(__name__)
+
+# Provider name -> adapter class, filled in by @register_provider
+PROVIDERS = {}
+
+# Provider name -> adapter instance, only built for providers an agent config uses
+_instances = {}
+
+# Idle connections are kept open this long, instead of httpx's default of 5 seconds, so connections
+# opened by warm_up are still open for the first turn and between turns
+KEEPALIVE_SECONDS = float(os.environ.get("LLM_SERVER_PROVIDER_KEEPALIVE_SECONDS", "120"))
+
+class InvalidProviderError(Exception):
+    pass
+
+def register_provider(name):
+    def decorator(cls):
+        cls.name = name
+        PROVIDERS[name] = cls
+        return cls
+    return decorator
+
+def get_provider(name):
+    """Return the adapter for the provider, importing its SDK and building its client on first use"""
+    if name not in _instances:
+        if name not in PROVIDERS:
+            raise InvalidProviderError(name)
+        start_time = time.monotonic()
+        _instances[name] = PROVIDERS[name]()
+        logger.info(f"Initialized {name} provider in {time.monotonic() - start_time:.3f}s")
+    return _instances[name]
+
+def initialized_providers():
+    return list(_instances)
+
+def provider_health():
+    """Warm-up state of each initialized provider, see Provider.warm"""
+    return {name: provider.health() for name, provider in _instances.items()}
+
+def httpx_limits():
+    import httpx
+    # The OpenAI and Anthropic SDKs' default limits, with a longer keepalive
+    return httpx.Limits(max_connections=1000, max_keepalive_connections=100, keepalive_expiry=KEEPALIVE_SECONDS)
+
+class Provider:
+    """
+    Base class for provider adapters.
+
+    Adapters import their SDK in create_client, so SDKs for providers no agent
+    uses are never imported. generate streams the response, passing each text
+    delta to on_delta and stopping the stream early once it returns True.
+    warm_up makes a cheap request, such as listing models, so the DNS lookup
+    and TLS handshake happen before the game rather than on the first turn.
+    api_key identifies the agent, for adapters which keep state per agent,
+    and forget drops that state when the agent's game ends.
+    """
+    name = None
+
+    def __init__(self):
+        self.client = self.create_client()
+        # cold, warming, ready or failed
+        self.state = "cold"
+        self.connections = 0
+        self.warm_up_seconds = None
+        self.error = None
+
+    def create_client(self):
+        raise NotImplementedError
+
+    async def generate(self, messages, agent_config, on_delta, api_key=None):
+        raise NotImplementedError
+
+    async def warm_up(self):
+        pass
+
+    def forget(self, api_key):
+        pass
+
+    def tokenizer(self, model):
+        """Return a function counting the model's tokens in a text, or None to estimate them"""
+        return None
+
+    async def warm(self, connections=1):
+        """
+        Open connections ahead of the first requests, one for each request
+        expected at once. An error response still counts as warm, since the
+        connection was made. Failures are logged and reported by health,
+        the first turn then pays for connecting as it did before.
+        """
+        if connections <= self.connections and self.state in ("warming", "ready"):
+            return
+        self.state = "warming"
+        start_time = time.monotonic()
+        results = await asyncio.gather(*(self.warm_up() for _ in range(connections)), return_exceptions=True)
+        self.warm_up_seconds = time.monotonic() - start_time
+        errors = [result for result in results if isinstance(result, Exception)]
+        # SDK errors for HTTP error responses have a status code, connection errors don't
+        failures = [error for error in errors if getattr(error, "status_code", None) is None]
+        if failures:
+            self.state = "failed"
+            self.error = f"{type(failures[0]).__name__}: {failures[0]}"
+            logger.warning(f"Failed to warm up {self.name} provider after {self.warm_up_seconds:.3f}s: {self.error}")
+        else:
+            self.state = "ready"
+            self.error = f"{type(errors[0]).__name__}: {errors[0]}" if errors else None
+            self.connections = max(self.connections, connections)
+            logger.info(f"Warmed up {connections} connections to {self.name} provider in {self.warm_up_seconds:.3f}s")
+
+    def health(self):
+        return {"state": self.state, "connections": self.connections, "warm_up_seconds": self.warm_up_seconds, "error": self.error}
+
+def mark_claude_cache_breakpoints(messages):
+    """
+    Mark the first message and the latest message as cacheable.
+
+    The first message holds the game prompt with the agent's source code, which
+    is identical every turn. Marking the latest message as well caches the
+    conversation so far, which the next turn's request extends.
+    """
+    marked = list(messages)
+    for idx in {0, len(messages) - 1}:
+        content = messages[idx]["content"]
+        if isinstance(content, str) and content:
+            marked[idx] = {
+                **messages[idx],
+                "content": [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+            }
+    return marked
+
+@register_provider("anthropic")
+class AnthropicProvider(Provider):
+    def create_client(self):
+        from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+        return AsyncAnthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"),
+                              http_client=DefaultAsyncHttpxClient(limits=httpx_limits()))
+
+    async def warm_up(self):
+        await self.client.models.list(limit=1)
+
+    async def generate(self, messages, agent_config, on_delta, api_key=None):
+        chunks = []
+        stopped_early = False
+        async with self.client.messages.stream(
+            max_tokens=8192,
+            messages=mark_claude_cache_breakpoints(messages),
+            model=agent_config['model'],
+        ) as stream:
+            # Leaving the context manager closes the stream, which stops generation
+            async for delta in stream.text_stream:
+                chunks.append(delta)
+                if on_delta(delta):
+                    stopped_early = True
+                    break
+
+            # Input usage is reported when the message starts, output usage only when it finishes
+            snapshot_usage = stream.current_message_snapshot.usage
+            cached_input_tokens = snapshot_usage.cache_read_input_tokens or 0
+            cache_write_tokens = snapshot_usage.cache_creation_input_tokens or 0
+            usage = Usage(
+                input_tokens=snapshot_usage.input_tokens + cached_input_tokens + cache_write_tokens,
+                cached_input_tokens=cached_input_tokens,
+                cache_write_tokens=cache_write_tokens,
+                output_tokens=None if stopped_early else snapshot_usage.output_tokens,
+            )
+        return Completion("".join(chunks), stopped_early=stopped_early, usage=usage)
+
+class OpenAICompatibleProvider(Provider):
+    base_url = None
+    api_key_env = None
+    include_usage = True
+
+    def create_client(self):
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        return AsyncOpenAI(base_url=self.base_url, api_key=os.environ.get(self.api_key_env),
+                           http_client=DefaultAsyncHttpxClient(limits=httpx_limits()))
+
+    async def warm_up(self):
+        await self.client.models.list()
+
+    def request_options(self, agent_config):
+        return {}
+
+    async def generate(self, messages, agent_config, on_delta, api_key=None):
+        kwargs = self.request_options(agent_config)
+        # Prompt caching is automatic for OpenAI-compatible providers, cached tokens are reported in the usage
+        if self.include_usage:
+            kwargs["stream_options"] = {"include_usage": True}
+        stream = await self.client.chat.completions.create(
+            model=agent_config['model'],
+            messages=messages,
+            stream=True,
+            **kwargs
+        )
+        chunks = []
+        usage = Usage()
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    # Only sent in the final chunk, so missing when the stream is stopped early
+                    details = chunk.usage.prompt_tokens_details
+                    usage = Usage(
+                        input_tokens=chunk.usage.prompt_tokens,
+                        cached_input_tokens=(details.cached_tokens or 0) if details else 0,
+                        output_tokens=chunk.usage.completion_tokens,
+                    )
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                delta = chunk.choices[0].delta.content
+                chunks.append(delta)
+                if on_delta(delta):
+                    return Completion("".join(chunks), stopped_early=True, usage=usage)
+        finally:
+            # Closing the stream early stops generation
+            await stream.close()
+        return Completion("".join(chunks), usage=usage)
+
+@register_provider("openai")
+class OpenAIProvider(OpenAICompatibleProvider):
+    api_key_env = "OPENAI_API_KEY"
+
+    def request_options(self, agent_config):
+        # Assumes using a reasoning model
+        return {"reasoning_effort": "high"}
+
+    def tokenizer(self, model):
+        try:
+            import tiktoken
+        except ImportError:
+            return None
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # The encoding couldn't be loaded, e.g. it isn't cached and there's no network
+            logger.warning(f"Failed to load tiktoken encoding for {model}, estimating tokens instead: {e}")
+            return None
+        # Agents can put special token text in their messages, count it as plain text
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+@register_provider("openrouter")
+class OpenRouterProvider(OpenAICompatibleProvider):
+    base_url = "https://openrouter.ai/api/v1"
+    api_key_env = "OPENROUTER_API_KEY"
+
+@register_provider("hyperbolic")
+class HyperbolicProvider(OpenAICompatibleProvider):
+    base_url = "https://api.hyperbolic.xyz/v1"
+    api_key_env = "HYPERBOLIC_API_KEY"
+    include_usage = False
+
+@register_provider("fireworks")
+class FireworksProvider(OpenAICompatibleProvider):
+    base_url = "https://api.fireworks.ai/inference/v1"
+    api_key_env = "FIREWORKS_API_KEY"
+
+@register_provider("gemini")
+class GeminiProvider(Provider):
+    """
+    Keeps a chat per agent, reused across turns while the agent's history
+    extends the chat's, so each turn only sends its new message to the chat
+    rather than converting and loading the whole history. The Gemini API is
+    stateless, so the chat still sends the full history with each message.
+    The chat is rebuilt when the history diverges, e.g. after compaction, or
+    when the last response was stopped early, which the chat doesn't record.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chats = {}  # api_key -> chat
+
+    def create_client(self):
+        from google import genai
+        return genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+
+    async def warm_up(self):
+        await self.client.aio.models.list(config={"page_size": 1})
+
+    def forget(self, api_key):
+        self._chats.pop(api_key, None)
+
+    def _create_chat(self, messages, agent_config):
+        from google.genai import types
+
+        # Convert OpenAI-style messages to Gemini format
+        gemini_messages = [
+            {
+                "role": "model" if msg["role"] == "assistant" else "user",
+                "parts": [{
+                    "text": msg["content"]
+                }]
+            }
+            for msg in messages
+        ]
+
+        # Assumes using a thinking model
+        return self.client.aio.chats.create(
+            model=agent_config['model'],
+            config=types.GenerateContentConfig(
+                thinking_config=types.ThinkingConfig(include_thoughts=True),
+                http_options=types.HttpOptions(api_version='v1alpha'),
+            ),
+            history=gemini_messages
+        )
+
+    async def generate(self, messages, agent_config, on_delta, api_key=None):
+        # Taken rather than shared, so a hedged attempt builds its own chat
+        chat = self._chats.pop(api_key, None)
+        if chat is None or chat_messages(chat) != [(msg["role"], msg["content"]) for msg in messages[:-1]]:
+            chat = self._create_chat(messages[:-1], agent_config)
+
+        stream = await chat.send_message_stream(messages[-1]["content"])
+        chunks = []
+        usage = Usage()
+        try:
+            async for chunk in stream:
+                if chunk.usage_metadata and chunk.usage_metadata.prompt_token_count is not None:
+                    # Gemini caches repeated prefixes implicitly, cached tokens are reported in the usage metadata
+                    usage = Usage(
+                        input_tokens=chunk.usage_metadata.prompt_token_count,
+                        cached_input_tokens=chunk.usage_metadata.cached_content_token_count or 0,
+                        output_tokens=(chunk.usage_metadata.candidates_token_count or 0) + (chunk.usage_metadata.thoughts_token_count or 0),
+                    )
+                # Thought-only chunks have no text
+                if not chunk.text:
+                    continue
+                chunks.append(chunk.text)
+                if on_delta(chunk.text):
+                    # Output counts in the usage metadata so far are partial
+                    usage.output_tokens = None
+                    return Completion("".join(chunks), stopped_early=True, usage=usage)
+        finally:
+            await stream.aclose()
+        if api_key is not None:
+            self._chats[api_key] = chat
+        return Completion("".join(chunks), usage=usage)
+
+def chat_messages(chat):
+    """A Gemini chat's history as (role, text) pairs, joining the streamed chunks of each response and leaving out thoughts"""
+    messages = []
+    for content in chat.get_history(curated=True):
+        role = "assistant" if content.role == "model" else "user"
+        text = "".join(part.text for part in content.parts or [] if part.text and not part.thought)
+        if role == "assistant" and messages and messages[-1][0] == "assistant":
+            messages[-1] = (role, messages[-1][1] + text)
+        else:
+            messages.append((role, text))
+    return messages
+
+@register_provider("mock")
+class MockProviderAdapter(Provider):
+    def create_client(self):
+        from mock_provider import MockProvider
+        return MockProvider()
+
+    async def generate(self, messages, agent_config, on_delta, api_key=None):
+        return await self.client.generate(messages, agent_config, on_delta)
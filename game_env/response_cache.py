@@ -0,0 +1,146 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+from interaction_log import read_interactions
+
+logger = logging.getLogger(__name__)
+
+CACHE_MODES = ["record", "replay", "passthrough"]
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of LLM responses.
+
+    Entries are keyed on a hash of (provider, model, messages) and stored as one
+    JSON file per key. The least recently used entries are evicted once the
+    cache holds more than max_entries.
+
+    Modes:
+        record: always call the provider and store the response
+        replay: return stored responses, calling the provider and storing the response on a miss
+        passthrough: the cache is not used
+    """
+
+    def __init__(self, cache_dir, mode="passthrough", max_entries=10000):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode: {mode}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_entries = max_entries
+        self._index = OrderedDict()  # key -> path, least recently used first
+        if self.mode != "passthrough":
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_index()
+
+    @staticmethod
+    def key(provider, model, messages):
+        payload = json.dumps([provider, model, messages], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load_index(self):
+        paths = glob.glob(os.path.join(self.cache_dir, "*", "*.json"))
+        paths.sort(key=os.path.getmtime)
+        for path in paths:
+            self._index[os.path.basename(path)[:-len(".json")]] = path
+        logger.info(f"Loaded {len(self._index)} cached responses from {self.cache_dir} in {self.mode} mode")
+
+    def lookup(self, provider, model, messages):
+        """Return the cached response text, or None on a miss or when not replaying."""
+        if self.mode != "replay":
+            return None
+        key = self.key(provider, model, messages)
+        path = self._index.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            del self._index[key]
+            return None
+        # Touch the entry so its recency survives a server restart
+        os.utime(path)
+        self._index.move_to_end(key)
+        return entry["response"]
+
+    def store(self, provider, model, messages, response):
+        if self.mode == "passthrough" or response is None:
+            return
+        key = self.key(provider, model, messages)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file and rename so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"provider": provider, "model": model, "response": response}, f)
+        os.replace(temp_path, path)
+        self._index[key] = path
+        self._index.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self._index) > self.max_entries:
+            _, path = self._index.popitem(last=False)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._index)
+
+def load_agent_configs_by_name(config_dir):
+    configs = {}
+    for path in glob.glob(os.path.join(config_dir, "*.json")):
+        with open(path) as f:
+            config = json.load(f)
+        configs[config["name"]] = config
+    return configs
+
+def import_interactions(cache, log_paths, configs_by_name):
+    """Seed the cache from llm_interactions.jsonl files. Returns the number of responses imported."""
+    imported = 0
+    for log_path in log_paths:
+        for entry in read_interactions(log_path):
+            provider = entry.get("provider")
+            model = entry.get("model")
+            if provider is None or model is None:
+                config = configs_by_name.get(entry["agent_name"])
+                if config is None or "provider" not in config:
+                    logger.warning(f"Skipping entry for unknown agent {entry['agent_name']} in {log_path}")
+                    continue
+                provider, model = config["provider"], config["model"]
+            cache.store(provider, model, entry["messages"], entry["response"])
+            imported += 1
+    return imported
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[logging.StreamHandler(sys.stdout)])
+    parser = argparse.ArgumentParser(description="Seed the LLM server response cache from llm_interactions.jsonl files")
+    parser.add_argument('--cache-dir', required=True,
+                       help='Response cache directory')
+    parser.add_argument('--agent-configs', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'agent_configs'),
+                       help='Directory of agent config files, used for logs which do not record the provider and model')
+    parser.add_argument('--max-entries', type=int, default=10000,
+                       help='Maximum number of cached responses')
+    parser.add_argument('log_files', nargs='+',
+                       help='One or more llm_interactions.jsonl files')
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache_dir, mode="record", max_entries=args.max_entries)
+    imported = import_interactions(cache, args.log_files, load_agent_configs_by_name(args.agent_configs))
+    logger.info(f"Imported {imported} responses, cache now holds {len(cache)} entries")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: timeouts, conflicts, rate limits, server errors and overloaded (529)
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# Exception class names, across the provider SDKs and httpx, for errors that never reached the model
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "TransportError", "TimeoutError"}
+
+SCHEDULER_DEFAULTS = {
+    "max_in_flight": 16,           # concurrent upstream requests
+    "requests_per_second": None,   # token bucket refill rate, None for no rate limit
+    "burst": 4,                    # token bucket capacity
+    "max_retries": 3,
+    "retry_base_seconds": 1.0,
+    "retry_max_seconds": 30.0,
+    "hedge": False,                # fire a duplicate request when the first token is slow
+    "hedge_percentile": 95,
+    "hedge_min_samples": 20,       # first token latencies needed before hedging starts
+}
+
+def load_scheduler_configs(path):
+    """Load per-provider scheduler settings from a JSON file of {provider: {setting: value}}"""
+    if not path:
+        return {}
+    with open(path) as f:
+        configs = json.load(f)
+    for provider, config in configs.items():
+        unknown = set(config) - set(SCHEDULER_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown scheduler settings for {provider}: {', '.join(sorted(unknown))}")
+    return configs
+
+def is_retryable(error):
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status in RETRYABLE_STATUS_CODES:
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+def retry_after_seconds(error):
+    """Return the Retry-After delay the provider asked for, if any"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class ProviderScheduler:
+    """
+    Schedules upstream requests for one provider.
+
+    Requests are limited to max_in_flight at once and, if requests_per_second
+    is set, rate limited by a token bucket. Retryable errors are retried with
+    jittered exponential backoff, as long as no text has been passed on yet.
+
+    With hedging enabled, a duplicate request is fired if the first token
+    hasn't arrived after the hedge_percentile of recent first token latencies
+    for the model. Whichever request streams first is used and the other is
+    cancelled, which closes its stream.
+    """
+
+    def __init__(self, name, **config):
+        self.name = name
+        self.config = {**SCHEDULER_DEFAULTS, **config}
+        self._in_flight = asyncio.Semaphore(self.config["max_in_flight"])
+        self._bucket = None
+        if self.config["requests_per_second"]:
+            self._bucket = TokenBucket(self.config["requests_per_second"], self.config["burst"])
+        self._first_delta_latencies = {}  # model -> recent first token latencies in seconds
+        self.stats = {"requests": 0, "retries": 0, "hedges": 0, "hedges_won": 0}
+
+    def hedge_delay(self, model):
+        """Seconds to wait for the first token before hedging, or None to not hedge"""
+        latencies = self._first_delta_latencies.get(model)
+        if not self.config["hedge"] or latencies is None or len(latencies) < self.config["hedge_min_samples"]:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.config["hedge_percentile"] / 100))]
+
+    def _record_first_delta(self, model, latency):
+        self._first_delta_latencies.setdefault(model, deque(maxlen=200)).append(latency)
+
+    async def _attempt(self, generate, on_delta):
+        if self._bucket is not None:
+            await self._bucket.acquire()
+        async with self._in_flight:
+            return await generate(on_delta)
+
+    async def run(self, model, generate, on_delta):
+        """
+        Run generate(on_delta) -> Completion under the scheduler's limits,
+        retrying and hedging as configured.
+        """
+        self.stats["requests"] += 1
+        started = False
+        def forward(delta):
+            nonlocal started
+            started = True
+            return on_delta(delta)
+
+        for retry in range(self.config["max_retries"] + 1):
+            try:
+                return await self._run_hedged(model, generate, forward)
+            except Exception as e:
+                # Once text has been passed on the cutoff and any stream have seen it, so don't retry
+                if started or retry == self.config["max_retries"] or not is_retryable(e):
+                    raise
+                backoff = min(self.config["retry_max_seconds"], self.config["retry_base_seconds"] * 2 ** retry)
+                delay = max(random.uniform(0, backoff), retry_after_seconds(e) or 0)
+                self.stats["retries"] += 1
+                logger.warning(f"Retrying {self.name} request for {model} in {delay:.2f}s after error: {e}")
+                await asyncio.sleep(delay)
+
+    async def _run_hedged(self, model, generate, on_delta):
+        start_time = time.monotonic()
+        tasks = []
+        winner = None
+
+        def attempt_on_delta(index):
+            def on_attempt_delta(delta):
+                nonlocal winner
+                if winner is None:
+                    winner = index
+                    self._record_first_delta(model, time.monotonic() - start_time)
+                    if index > 0:
+                        self.stats["hedges_won"] += 1
+                    for other, task in enumerate(tasks):
+                        if other != index:
+                            task.cancel()
+                if winner != index:
+                    return True
+                return on_delta(delta)
+            return on_attempt_delta
+
+        tasks.append(asyncio.create_task(self._attempt(generate, attempt_on_delta(0))))
+        try:
+            hedge_delay = self.hedge_delay(model)
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                # Don't hedge when at the in-flight limit, it would only queue behind the first request
+                if not done and winner is None and not self._in_flight.locked():
+                    logger.info(f"Hedging {self.name} request for {model} after {hedge_delay:.2f}s without a first token")
+                    self.stats["hedges"] += 1
+                    tasks.append(asyncio.create_task(self._attempt(generate, attempt_on_delta(1))))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # Skip requests cancelled or stopped because the other one streamed first
+                    if task.cancelled() or (winner is not None and tasks[winner] is not task):
+                        continue
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    if winner is not None:
+                        raise error
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Let cancelled requests close their streams
+            await asyncio.gather(*tasks, return_exceptions=True)
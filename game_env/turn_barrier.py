@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+class TurnBarrier:
+    """
+    Turn clock for simultaneous-turn games.
+
+    Each agent arrives at the barrier once its response for the current turn is
+    ready. Arrivals are keyed by turn, and when the last agent arrives every
+    waiter for that turn is released at the same instant by setting its event,
+    instead of each request polling a shared counter.
+
+    Each turn has a deadline, counted from when the previous turn was released
+    (or from the first arrival for turn 0). At the deadline the turn is
+    released without the agents that haven't arrived, which forfeit it. A
+    forfeiting agent's late response counts as its response for the next turn
+    and is released with it, so the game takes at most deadline_seconds per
+    turn however slow a model is.
+
+    Waiters register the event loop they are waiting on, so the barrier can be
+    released from any thread or event loop.
+    """
+
+    def __init__(self, participants, deadline_seconds=60, on_release=None):
+        self.turn_count = 0
+        self.deadline_seconds = deadline_seconds
+        # Called with each turn's record when it is released, see _release_completed_turns
+        self.on_release = on_release
+        self._turn_map = {api_key: 0 for api_key in participants}
+        self._waiters = defaultdict(list)  # turn -> [(loop, event)]
+        self._arrival_times = defaultdict(dict)  # turn -> {api_key: arrival time}
+        self._forfeits = defaultdict(list)  # turn -> [api_key]
+        self._release_times = {}  # turn -> release time
+        self._turn_started_at = None  # monotonic and wall clock start of the current turn
+        self._deadline_timer = None
+        self._loop = None
+        self._lock = threading.Lock()
+
+    async def wait(self, api_key):
+        """
+        Mark the agent's turn complete and wait until the turn is released.
+
+        Returns (turn, seconds waited at the barrier). The turn is later than
+        the agent's previous one plus one if it forfeited turns in between.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._lock:
+            self._loop = loop
+            if self._turn_started_at is None:
+                self._start_turn()
+            # A late response is queued for the turn in progress
+            turn = max(self._turn_map[api_key], self.turn_count)
+            self._turn_map[api_key] = turn + 1
+            arrived_at = time.monotonic()
+            self._arrival_times[turn][api_key] = arrived_at
+            self._waiters[turn].append((loop, event))
+            self._release_completed_turns()
+
+        await event.wait()
+        return turn, self._release_times[turn] - arrived_at
+
+    def close(self):
+        with self._lock:
+            if self._deadline_timer is not None:
+                self._deadline_timer.cancel()
+                self._deadline_timer = None
+
+    def _start_turn(self):
+        # Must be called with self._lock held, from the event loop thread
+        self._turn_started_at = (time.monotonic(), time.time())
+        if self.deadline_seconds is not None and self._loop is not None:
+            self._deadline_timer = self._loop.call_later(self.deadline_seconds, self._on_deadline, self.turn_count)
+
+    def _on_deadline(self, turn):
+        with self._lock:
+            if turn != self.turn_count:
+                return
+            late = [api_key for api_key, next_turn in self._turn_map.items() if next_turn <= turn]
+            logger.warning(f"Turn {turn} deadline of {self.deadline_seconds}s passed, forfeited by: {late}")
+            for api_key in late:
+                self._turn_map[api_key] = turn + 1
+                self._forfeits[turn].append(api_key)
+            self._release_completed_turns()
+
+    def _release_completed_turns(self):
+        # Must be called with self._lock held
+        while self._turn_map and min(self._turn_map.values()) > self.turn_count:
+            turn = self.turn_count
+            released_at = time.monotonic()
+            self._release_times[turn] = released_at
+            if self._deadline_timer is not None:
+                self._deadline_timer.cancel()
+                self._deadline_timer = None
+            for loop, event in self._waiters.pop(turn, []):
+                loop.call_soon_threadsafe(event.set)
+
+            started_at, started_at_wall = self._turn_started_at
+            arrival_times = self._arrival_times.pop(turn, {})
+            wait_times = {api_key: round(released_at - arrived_at, 3) for api_key, arrived_at in arrival_times.items()}
+            forfeits = self._forfeits.pop(turn, [])
+            logger.info(f"Released turn {turn} after {released_at - started_at:.3f}s, barrier wait seconds per agent: {wait_times}"
+                        f"{f', forfeited by: {forfeits}' if forfeits else ''}")
+            if self.on_release is not None:
+                self.on_release({
+                    "turn": turn,
+                    "started_at": started_at_wall,
+                    "deadline_at": started_at_wall + self.deadline_seconds if self.deadline_seconds is not None else None,
+                    "released_at": started_at_wall + (released_at - started_at),
+                    "arrival_seconds": {api_key: round(arrived_at - started_at, 3) for api_key, arrived_at in arrival_times.items()},
+                    "forfeits": forfeits,
+                })
+
+            self.turn_count += 1
+            self._start_turn()
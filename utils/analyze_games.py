@@ -62,20 +62,24 @@ def process_game_result(game_dir):
         'self_killed': 0,
         'killed_by_other': 0,
         'kills': 0,
-        'tripwire_kills': 0
+        'tripwire_kills': 0,
+        'total_tokens': 0,
+        'cost_usd': 0.0
     })
 
     # Build process hierarchy and track agent processes
     # agent_processes: Dict[agent_id, List[pid]]
     agent_processes = {}
 
-    # First build complete map of parent-child relationships
+    # First build complete map of parent-child relationships, from forks as well as execs
+    # since a process can be forked without exec'ing, e.g. by the agents' warm launcher
     process_children = defaultdict(list)
     for event in process_events:
-        if event['type'] == 'E':
+        if event['type'] in ('E', 'F'):
             ppid = event['ppid']
             pid = event['pid']
-            process_children[ppid].append(pid)
+            if pid not in process_children[ppid]:
+                process_children[ppid].append(pid)
 
     # Now populate agent_processes using the complete process hierarchy
     def add_children_recursive(pid, pid_list):
@@ -151,6 +155,11 @@ def process_game_result(game_dir):
         # Agent always has a 'total' increment (survived or killed)
         game_stats[agent_key]['total'] += 1
 
+        # Token usage is missing from games run before it was recorded
+        usage = agent.get('usage') or {}
+        game_stats[agent_key]['total_tokens'] += usage.get('total_tokens', 0)
+        game_stats[agent_key]['cost_usd'] += usage.get('cost_usd', 0.0)
+
     # Compare game_stats with the game_result
     for agent in game_result['agents']:
         agent_key = (agent['name'], agent['id'])
@@ -201,7 +210,9 @@ def analyze_game_results(base_dir):
         'self_killed': 0,
         'killed_by_other': 0,
         'kills': 0,
-        'tripwire_kills': 0
+        'tripwire_kills': 0,
+        'total_tokens': 0,
+        'cost_usd': 0.0
     })
 
     # Track any agent IDs that appear as tripwire
@@ -234,7 +245,8 @@ def analyze_game_results(base_dir):
     # Prepare table data
     headers = [
         'Agent', 'ID', 'Survived', 'Killed', 'Self Kills',
-        'Killed by Other', 'Kills', 'Tripwire Kills', 'Total Games', 'Survival Rate'
+        'Killed by Other', 'Kills', 'Tripwire Kills', 'Total Games', 'Survival Rate',
+        'Tokens', 'Cost (USD)', 'Kills per 1k Tokens'
     ]
     table_data = []
 
@@ -243,6 +255,8 @@ def analyze_game_results(base_dir):
         total_games = data['total']
         survived = data['survived']
         survival_rate = (survived / total_games * 100) if total_games > 0 else 0.0
+        # Efficiency: how many kills the agent got for the tokens it used
+        kills_per_1k_tokens = f"{data['kills'] / data['total_tokens'] * 1000:.3f}" if data['total_tokens'] > 0 else "n/a"
 
         table_data.append([
             agent_name,
@@ -254,7 +268,10 @@ def analyze_game_results(base_dir):
             data['kills'],
             data['tripwire_kills'],
             total_games,
-            f"{survival_rate:.1f}%"
+            f"{survival_rate:.1f}%",
+            data['total_tokens'],
+            f"{data['cost_usd']:.2f}",
+            kills_per_1k_tokens
         ])
 
     # Sort by survival rate descending
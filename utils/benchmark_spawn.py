@@ -0,0 +1,59 @@
+"""
+Measures how long the programs agents spawn take to print their first line,
+starting them directly and forking them from the warm launcher.
+
+Usage: python benchmark_spawn.py [number of spawns]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agents"))
+from supervisor import ChildSupervisor
+
+# A typical generated program, importing a few modules before doing anything
+PROGRAM = """
+import json
+import os
+import psutil
+import time
+print(json.dumps({"pid": os.getpid(), "cpus": psutil.cpu_count()}), flush=True)
+"""
+
+def time_to_first_line(supervisor, program_path, log_dir, index):
+    stdout_path = os.path.join(log_dir, f"spawn_{index}.log")
+    start = time.perf_counter()
+    child = supervisor.spawn(program_path, stdout_path, os.path.join(log_dir, f"spawn_{index}_err.log"))
+    while True:
+        try:
+            with open(stdout_path, "rb") as f:
+                if b"\n" in f.read():
+                    break
+        except FileNotFoundError:
+            pass
+        if child.exited:
+            raise RuntimeError(f"{program_path} exited with {child.returncode} before printing anything")
+        time.sleep(0.0002)
+    elapsed = time.perf_counter() - start
+    while not child.exited:
+        time.sleep(0.001)
+    return elapsed
+
+def benchmark(warm, spawns, log_dir):
+    program_path = os.path.join(log_dir, "program.py")
+    with open(program_path, "w") as f:
+        f.write(PROGRAM)
+    supervisor = ChildSupervisor(warm=warm)
+    # Not timed, the launcher is started once per agent
+    time_to_first_line(supervisor, program_path, log_dir, "warmup")
+    timings = sorted(time_to_first_line(supervisor, program_path, log_dir, i) for i in range(spawns))
+    return statistics.median(timings), timings[int(0.95 * (len(timings) - 1))]
+
+if __name__ == "__main__":
+    spawns = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    for warm in (False, True):
+        with tempfile.TemporaryDirectory() as log_dir:
+            p50, p95 = benchmark(warm, spawns, log_dir)
+        print(f"{'warm launcher' if warm else 'direct':<14} p50 {p50 * 1000:6.1f} ms  p95 {p95 * 1000:6.1f} ms  ({spawns} spawns)")